@@ -1,12 +1,17 @@
 import customtkinter
+import logging
 import queue
 import subprocess
 import sys
 import threading
 import tkinter
 import tkinter.messagebox
-from get_data import get_est_list
-from main import main
+from logging.handlers import RotatingFileHandler
+from config import (PROGRESS_REFRESH_MS, CONSOLE_MAX_LINES, CONSOLE_FLUSH_MS, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+                    data_path)
+from est_list_cache import load_cached_est_list, save_est_list_cache
+from est_selection import EstablishmentSelection
+from progress import progress, format_progress
 
 
 # Global variables
@@ -22,19 +27,168 @@ APP_NAME = "Upcharge Patch"
 
 # Using TextboxStream to output the print statements to the 'Output Console' within the GUI
 class TextboxStream:
-    def __init__(self, textbox, text_queue):
+    ''' print() is called from the worker threads as well as the main thread, and Tk widgets can only be touched from
+    the main thread. So write() only puts the text on a thread-safe queue. The GUI drains the queue on a timer with
+    flush_to_textbox(), inserting everything that came in since the last flush in one go and trimming the console down
+    to the last CONSOLE_MAX_LINES lines. Every batch is also written to a rotating log file in the data folder, so
+    the full output of a long run is still there after the console has dropped it.'''
+    def __init__(self, textbox, text_queue, max_lines=CONSOLE_MAX_LINES):
         self.textbox = textbox
         self.queue = text_queue
+        self.max_lines = max_lines
         self.textbox.configure(wrap=tkinter.WORD)
 
+        # The log file takes the console text as is, so no format or added line endings on each record
+        self.logger = logging.getLogger("upcharge.console")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(data_path(LOG_FILE), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                          encoding='utf-8')
+            handler.terminator = ''
+            self.logger.addHandler(handler)
+
     def write(self, text):
         self.queue.put(text)
-        self.textbox.insert(tkinter.END, text)
-        self.textbox.see(tkinter.END)
 
     def flush(self):
         pass
 
+    # Called from the main loop. Moves everything written since the last call into the textbox and the log file
+    def flush_to_textbox(self):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not chunks:
+            return
+
+        text = ''.join(chunks)
+        self.logger.info(text)
+        self.textbox.insert(tkinter.END, text)
+
+        # Drop the oldest lines once the console holds more than max_lines
+        line_count = int(self.textbox.index('end-1c').split('.')[0])
+        if line_count > self.max_lines:
+            self.textbox.delete('1.0', f'{line_count - self.max_lines + 1}.0')
+        self.textbox.see(tkinter.END)
+
+
+# Searchable list of establishment switches that only creates a switch for each row that fits on screen
+class EstablishmentList(customtkinter.CTkFrame):
+    ''' A CTkScrollableFrame with a switch per establishment gets slow to build and scroll once the fleet is in the
+    hundreds. This list keeps a small pool of switches, one per visible row, and scrolling just changes which
+    establishment each of them shows. Whether an establishment is selected lives in the EstablishmentSelection model
+    (est_selection.py), not on the switches, so rows that are scrolled away keep their state.'''
+
+    # Height of a switch plus the space under it
+    ROW_HEIGHT = 44
+
+    def __init__(self, master, selection, label_text="Site List", **kwargs):
+        super().__init__(master, **kwargs)
+        self.selection = selection
+        # Positions (in the model) of the establishments that match the search, and the first one on screen
+        self.rows = selection.filter("")
+        self.top = 0
+        self.switches = []
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+        self.label = customtkinter.CTkLabel(self, text=label_text)
+        self.label.grid(row=0, column=0, columnspan=2, pady=(5, 0))
+        self.search_entry = customtkinter.CTkEntry(self, placeholder_text="Search name or id")
+        self.search_entry.grid(row=1, column=0, columnspan=2, padx=10, pady=(5, 10), sticky="ew")
+        self.search_entry.bind("<KeyRelease>", self.apply_search)
+
+        # The rows frame keeps its size, the number of switches follows its height (see on_resize)
+        self.rows_frame = customtkinter.CTkFrame(self, fg_color="transparent")
+        self.rows_frame.grid(row=2, column=0, sticky="nsew")
+        self.rows_frame.grid_propagate(False)
+        self.rows_frame.bind("<Configure>", self.on_resize)
+        self.scrollbar = customtkinter.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.grid(row=2, column=1, sticky="ns")
+        self.count_label = customtkinter.CTkLabel(self, text="")
+        self.count_label.grid(row=3, column=0, columnspan=2, pady=(0, 5))
+        self.bind_mousewheel(self.rows_frame)
+
+    # Scrolling with the mouse wheel (Windows/macOS send <MouseWheel>, Linux sends buttons 4 and 5)
+    def bind_mousewheel(self, widget):
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            widget.bind(sequence, self.on_mousewheel)
+
+    ''' DRAWING '''
+    # Adds or removes switches so there is one for every row that fits
+    def on_resize(self, event):
+        visible = max(1, event.height // self.ROW_HEIGHT)
+        while len(self.switches) < visible:
+            slot = len(self.switches)
+            switch = customtkinter.CTkSwitch(master=self.rows_frame, text="",
+                                             command=lambda slot=slot: self.on_toggle(slot))
+            switch.grid(row=slot, column=0, padx=10, pady=(0, 20), sticky="w")
+            self.bind_mousewheel(switch)
+            self.switches.append(switch)
+        while len(self.switches) > visible:
+            self.switches.pop().destroy()
+        self.redraw()
+
+    # Points every switch at the establishment in its row
+    def redraw(self):
+        self.top = max(0, min(self.top, len(self.rows) - len(self.switches)))
+        for slot, switch in enumerate(self.switches):
+            position = self.top + slot
+            if position >= len(self.rows):
+                switch.grid_remove()
+                continue
+            index = self.rows[position]
+            switch.configure(text=self.selection.names[index])
+            if self.selection.is_selected(index):
+                switch.select()
+            else:
+                switch.deselect()
+            switch.grid()
+
+        if self.rows:
+            self.scrollbar.set(self.top / len(self.rows), min(1.0, (self.top + len(self.switches)) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.update_count()
+
+    def update_count(self):
+        text = f"{len(self.selection.selected)} of {len(self.selection)} selected"
+        if len(self.rows) != len(self.selection):
+            text += f", {len(self.rows)} shown"
+        self.count_label.configure(text=text)
+
+    # Called after the model has changed (new list, everything selected or cleared)
+    def refresh(self):
+        self.rows = self.selection.filter(self.search_entry.get())
+        self.redraw()
+
+    ''' EVENTS '''
+    def on_toggle(self, slot):
+        self.selection.set_selected(self.rows[self.top + slot], bool(self.switches[slot].get()))
+        self.update_count()
+
+    def apply_search(self, event=None):
+        self.rows = self.selection.filter(self.search_entry.get())
+        self.top = 0
+        self.redraw()
+
+    # Scrollbar commands: ('moveto', fraction) when dragged, ('scroll', steps, 'units' or 'pages') when clicked
+    def on_scrollbar(self, action, value, unit="units"):
+        if action == "moveto":
+            self.top = int(float(value) * len(self.rows))
+        else:
+            self.top += int(value) * (len(self.switches) if unit == "pages" else 1)
+        self.redraw()
+
+    def on_mousewheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.top += -2 if up else 2
+        self.redraw()
+
 
 # Event for when the CSV button is pressed
 def csv_button_event():
@@ -70,6 +224,10 @@ class GUI(customtkinter.CTk):
         self.sidebar_button_3 = customtkinter.CTkButton(self.sidebar_frame, command=csv_button_event,
                                                         text="CSV Files")
         self.sidebar_button_3.grid(row=1, column=0, padx=20, pady=10)
+        # Picks up the last run where it was stopped, from its journal (see journal.py)
+        self.resume_button = customtkinter.CTkButton(self.sidebar_frame, command=self.resume_button_click,
+                                                     text="Resume Last Run")
+        self.resume_button.grid(row=2, column=0, padx=20, pady=10)
 
 
         ''' PATCH BUTTON'''
@@ -89,9 +247,11 @@ class GUI(customtkinter.CTk):
         ''' TEXT BOX OUTPUT CONSOLE '''
         self.textbox = customtkinter.CTkTextbox(self, width=250)
         self.textbox.grid(row=0, column=1, rowspan=3, padx=(20, 0), pady=(20, 0), sticky="nsew")
-        # Redirect print statements to the textbox
+        # Redirect print statements to the textbox. The queue is flushed into it on a timer (flush_console)
         self.output_queue = queue.Queue()
-        sys.stdout = TextboxStream(self.textbox, self.output_queue)
+        self.console = TextboxStream(self.textbox, self.output_queue)
+        sys.stdout = self.console
+        self.after(CONSOLE_FLUSH_MS, self.flush_console)
 
 
         ''' RADIO BUTTON FRAME FOR MODE SELECTION'''
@@ -115,16 +275,20 @@ class GUI(customtkinter.CTk):
         self.all_est_radio_button.bind("<ButtonRelease-1>", self.all_est_button_click)
 
 
-        ''' SCROLLABLE FRAME FOR EST SWITCHES '''
-        self.scrollable_frame = customtkinter.CTkScrollableFrame(self, label_text="Site List")
-        self.scrollable_frame.grid(row=0, column=2, rowspan=4, padx=(20, 0), pady=(20, 20), sticky="nsew")
-        self.scrollable_frame.grid_columnconfigure(0, weight=1)
-        # Define scrollable_frame_switches as an instance variable
-        self.scrollable_frame_switches = []
-        # Retrieve the establishment data and populate switches as well as the global variable definition
+        ''' ESTABLISHMENT LIST '''
+        ''' The list is populated from the establishment list saved on the last run, so the window opens right away.
+        The live list is pulled in a background thread and swapped in when it arrives. If the live call fails, the
+        saved list stays up.'''
         global est_data
-        est_data = get_est_list()
-        self.populate_switches_from_dict()
+        est_data = load_cached_est_list()
+        # Which establishments are selected is kept in the model, the list only draws the rows on screen
+        self.selection = EstablishmentSelection(est_data)
+        self.est_list = EstablishmentList(self, self.selection, label_text="Site List")
+        self.est_list.grid(row=0, column=2, rowspan=4, padx=(20, 0), pady=(20, 20), sticky="nsew")
+        # The background thread hands its result back through this queue, which the main loop checks on a timer
+        self.est_list_queue = queue.Queue()
+        threading.Thread(target=self.fetch_est_list, daemon=True).start()
+        self.after(100, self.check_est_list)
 
 
         ''' PROGRESS BAR '''
@@ -134,6 +298,13 @@ class GUI(customtkinter.CTk):
         self.progressbar_frame.grid_rowconfigure(3, weight=1)
         self.progressbar = customtkinter.CTkProgressBar(self.progressbar_frame)
         self.progressbar.grid(row=1, column=0, padx=(20, 10), pady=(10, 10), sticky="ew")
+        # Status line under the bar with the counts, throughput and ETA of the current run
+        self.progress_label = customtkinter.CTkLabel(self.progressbar_frame, text="", anchor="w")
+        self.progress_label.grid(row=2, column=0, padx=(20, 10), sticky="ew")
+        ''' Progress events come in from the worker threads while a run is going (see start_run). The callback only
+        keeps the latest snapshot, and check_operation_status draws it on the main loop, since Tk widgets can't be
+        touched from other threads.'''
+        self.latest_progress = None
 
 
         ''' DEFAULT VALUES '''
@@ -148,39 +319,47 @@ class GUI(customtkinter.CTk):
         # Clearing out the textbox
         self.textbox.delete("1.0", tkinter.END)
 
-        # Setting the progress bar to 'indeterminate', which will make it move while processing is active
-        self.progressbar.configure(mode="indeterminate")
-        self.progressbar.start()
+        ''' Get the selected establishments from the selection model to populate id_list for call to main function '''
+        selected = self.selection.selected_items()
+        for est_name, est_id in selected:
+            # Print the est id and name for clarity in GUI which establishments are selected on run
+            print(f"Est {est_id}: {est_name}\n")
 
-        # Disabling the 'Patch' button, so it cannot be clicked while function is running
-        self.patch_button.configure(state="disabled")
-
-        # Reference the est_data variable, which is populated on creation with est data
-        global est_data
+        # The id_list will be passed to the main function for execution
+        id_list = [est_id for _, est_id in selected]
 
-        # Create a list to store the "id" values
-        id_list = []
+        self.start_run(id_list)
 
-        ''' Get switch status and populate id_list for call to main function '''
-        # Get the "id" values associated with the names of switches that are in the "On" state
-        for i, switch in enumerate(self.scrollable_frame_switches):
-            # Check if switch is selected
-            if switch.get():
-                # Get the text of the switch, will be the same as the key in the dict ('name')
-                est_name = switch.cget('text')
-                # Get the 'id' of the est from the dict
-                est_id = est_data.get(est_name)
+    # Resume button event. The establishments come from the journal of the stopped run, not the switches
+    def resume_button_click(self):
+        self.textbox.delete("1.0", tkinter.END)
+        self.start_run([], resume=True)
 
-                # Print the est id and name for clarity in GUI which establishments are selected on run
-                print(f"Est {est_id}: {est_name}\n")
+    # Starts a run in a background thread, shared by the patch and resume buttons
+    def start_run(self, id_list, resume=False):
+        # The progress bar fills in as progress events come in from the run (see check_operation_status)
+        self.latest_progress = None
+        self.progressbar.configure(mode="determinate")
+        self.progressbar.set(0)
+        self.progress_label.configure(text="")
+        # Follow the progress of this run only. Unsubscribed again once it is finished
+        progress.subscribe(self.on_progress)
 
-                # Append the id to the id_list, which will be passed to the main function for execution
-                id_list.append(est_id)
+        # Disabling the 'Patch' and 'Resume' buttons, so they cannot be clicked while function is running
+        self.patch_button.configure(state="disabled")
+        self.resume_button.configure(state="disabled")
 
         # Defining a function to run this in a separate thread. Keeps GUI functional while running
         def run_operation():
+            # Imported here rather than at the top, so the window opens without waiting on pandas and requests to load
+            from main import main
+            from http_client import close_session
             # Calling the main function with the id_list as a param. Gets data in parallel for each est in list.
-            main(id_list)
+            try:
+                main(id_list, resume=resume)
+            finally:
+                # Close the pooled connections between runs. The next run opens a fresh session
+                close_session()
             # Notify the main thread that the operation is complete. (Does nothing. Text output handled in func)
             self.operation_complete()
 
@@ -195,14 +374,26 @@ class GUI(customtkinter.CTk):
 
     ''' THREAD FUNCTIONS '''
     def check_operation_status(self, operation_thread):
+        # Draw the latest progress of the run
+        snapshot = self.latest_progress
+        if snapshot is not None:
+            self.progressbar.set(snapshot["fraction"])
+            self.progress_label.configure(text=format_progress(snapshot))
+
         # If thread is alive, keep checking until it is finished
         if operation_thread.is_alive():
-            self.after(1000, lambda: self.check_operation_status(operation_thread))
+            self.after(PROGRESS_REFRESH_MS, lambda: self.check_operation_status(operation_thread))
         else:
-            # The thread has completed. Make the patch button active again and stop the progress bar from moving
-            self.progressbar.stop()
-            self.progressbar.configure(mode="determinate")
+            # The thread has completed. Make the patch and resume buttons active again and fill the progress bar
+            progress.unsubscribe(self.on_progress)
+            self.progressbar.set(1)
             self.patch_button.configure(state="normal")
+            self.resume_button.configure(state="normal")
+
+
+    def on_progress(self, event, snapshot):
+        # Called from whichever thread emitted the event. Only keeps the snapshot for the main loop to draw
+        self.latest_progress = snapshot
 
 
     def operation_complete(self):
@@ -210,32 +401,65 @@ class GUI(customtkinter.CTk):
         pass
 
 
+    ''' OUTPUT CONSOLE '''
+    def flush_console(self):
+        # Move whatever was printed since the last flush into the textbox, then check again after CONSOLE_FLUSH_MS
+        self.console.flush_to_textbox()
+        self.after(CONSOLE_FLUSH_MS, self.flush_console)
+
+
+    ''' ESTABLISHMENT LIST REFRESH '''
+    def fetch_est_list(self):
+        # Runs in the background thread. Tk widgets can't be touched from here, so the result goes on the queue
+        try:
+            # Imported in the background thread, so loading pandas and requests doesn't hold up the window
+            from get_data import get_est_list
+            self.est_list_queue.put(get_est_list())
+        except Exception as exc:
+            self.est_list_queue.put(exc)
+
+
+    def check_est_list(self):
+        # If the live list hasn't arrived yet, check again shortly
+        try:
+            result = self.est_list_queue.get_nowait()
+        except queue.Empty:
+            self.after(100, self.check_est_list)
+            return
+
+        global est_data
+        # On a failed call (or an empty list), keep showing the saved list
+        if isinstance(result, Exception) or not result:
+            reason = result if isinstance(result, Exception) else "no establishments returned"
+            print(f"Could not refresh the establishment list ({reason}). Showing the saved list.\n")
+            return
+
+        # Save the live list for the next start, and only rebuild the switches if something changed
+        save_est_list_cache(result)
+        if result == est_data:
+            return
+
+        # The model keeps whatever the user already switched on while the list was loading
+        est_data = result
+        self.selection.set_establishments(est_data)
+        if self.radio_var.get() == 1:
+            self.selection.select_all()
+        self.est_list.refresh()
+
+
     ''' RADIO BUTTON EVENTS '''
     def all_est_button_click(self, event):
-        # If clicked, for each switch in the scrollable frame, set the state to active (select())
+        # If clicked, select every establishment in the model and redraw the rows on screen
         if self.radio_var.get() == 1:
-            for switch in self.scrollable_frame_switches:
-                switch.select()
+            self.selection.select_all()
+            self.est_list.refresh()
 
 
     def select_est_button_click(self, event):
-        # If clicked, deselect all switches within the frame
+        # If clicked, clear the selection
         if self.radio_var.get() == 0:
-            for switch in self.scrollable_frame_switches:
-                switch.deselect()
-
-
-    ''' POPULATE RADIO BUTTONS '''
-    def populate_switches_from_dict(self):
-        # For each est in est_data...
-        for i, est_name in enumerate(est_data.keys()):
-            # Create a switch with the name of the est
-            switch = customtkinter.CTkSwitch(
-                master=self.scrollable_frame,
-                text=est_name
-            )
-            switch.grid(row=i, column=0, padx=10, pady=(0, 20), sticky="w")
-            self.scrollable_frame_switches.append(switch)
+            self.selection.clear()
+            self.est_list.refresh()
 
 
 if __name__ == "__main__":
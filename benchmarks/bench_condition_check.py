@@ -0,0 +1,43 @@
+import os
+import sys
+import timeit
+import pandas as pd
+
+# Running from the benchmarks folder, so the project modules are one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from condition_check import check_if_item_needs_patch, items_needing_patch
+
+
+''' Micro-benchmark for the condition check. Takes the sample products_data_.csv (one establishment) and repeats it
+    to the size of a full fleet, then times the row-wise apply() against the vectorized mask.
+
+    Usage: python benchmarks/bench_condition_check.py [establishments] [repeats]'''
+
+def main():
+    establishments = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    # Reading everything as strings, the same way the values come back from the API
+    sample = pd.read_csv(os.path.join(ROOT, 'data_files', 'products_data_.csv'), dtype=str)
+    # Break a few of the prices so the unparseable path is part of the run as well
+    sample.loc[sample.index[::50], 'price'] = 'N/A'
+    df = pd.concat([sample] * establishments, ignore_index=True)
+    print(f"{len(df):,} rows ({establishments} establishments x {len(sample):,} items)")
+
+    # Both versions have to agree before the timings mean anything
+    row_mask = df.apply(check_if_item_needs_patch, axis=1).astype(bool)
+    vector_mask = items_needing_patch(df)
+    assert row_mask.equals(vector_mask), "vectorized mask does not match the row-wise check"
+
+    apply_time = min(timeit.repeat(lambda: df.apply(check_if_item_needs_patch, axis=1), number=1, repeat=repeats))
+    vector_time = min(timeit.repeat(lambda: items_needing_patch(df), number=1, repeat=repeats))
+
+    print(f"apply(axis=1):        {apply_time:.4f}s")
+    print(f"items_needing_patch:  {vector_time:.4f}s")
+    print(f"speedup:              {apply_time / vector_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
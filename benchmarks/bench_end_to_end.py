@@ -0,0 +1,156 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+# Running from the benchmarks folder, so the project modules are one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from mock_revel_server import add_server_args, server_from_args
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak memory then needs --tracemalloc
+    resource = None
+
+
+''' End to end benchmark of main.main against the local mock Revel server (mock_revel_server.py). The server runs in
+    its own process, so it doesn't share the GIL with the run being timed. The result files go to a temp folder, so
+    nothing in data_files is touched, and the category cache starts cold (use --repeat to see a warm run).
+
+    Reports the wall time of the run, fetch (GET) and patch (PATCH) requests per second as seen by the server, the
+    429s and errors that were injected, and peak memory (process RSS, or the Python heap with --tracemalloc, which
+    slows the run down).
+
+    Usage:
+        python benchmarks/bench_end_to_end.py                                   120 x 3,048 fleet, no faults
+        python benchmarks/bench_end_to_end.py --establishments 20 --latency 0.05 --rate-429 0.02
+        python benchmarks/bench_end_to_end.py --batch --json before.json          save the numbers to compare later'''
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time a full run of the app against the mock Revel server.")
+    add_server_args(parser)
+    parser.add_argument("--batch", action="store_true", help="time the batch path instead of streaming")
+    parser.add_argument("--delta", action="store_true", help="time a delta run (use with --repeat)")
+    parser.add_argument("--dry-run", action="store_true", help="fetch and check only")
+    parser.add_argument("--workers", type=int, help="max requests in flight (default from config)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs in a row against the same server (default 1)")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure the peak Python heap with tracemalloc")
+    parser.add_argument("--json", help="also write the results of each run to this json file")
+    return parser.parse_args(argv)
+
+
+# Runs in the server process. Hands the port back to the parent once the server is listening
+def serve(args, port_queue):
+    server = server_from_args(args)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+# Request counters of the server. reset starts them from zero again, for the next run
+def server_stats(url, reset=False):
+    with urllib.request.urlopen(f"{url}/__stats__{'?reset=1' if reset else ''}") as response:
+        return json.load(response)
+
+
+# Requests per second between the first and last request of a kind
+def per_second(stats, kind):
+    count = stats.get(kind, 0)
+    span = stats.get(f"{kind}_last", 0) - stats.get(f"{kind}_first", 0)
+    return count / span if span > 0 else 0.0
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    args = parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args, port_queue), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    ''' Settings are changed on config before the rest of the app is imported, the same way cli.py does it.'''
+    config.BASE_URL = url
+    config.DATA_DIR = tempfile.mkdtemp(prefix="upcharge_bench_")
+    if args.workers:
+        config.MAX_WORKERS = args.workers
+        config.PATCH_WORKERS = args.workers
+        config.MAX_CONCURRENCY = args.workers
+        config.INITIAL_CONCURRENCY = min(config.INITIAL_CONCURRENCY, args.workers)
+
+    from main import main as run
+    from rate_limiter import limiter
+
+    id_list = list(range(1, args.establishments + 1))
+    mode = "batch" if args.batch else "streaming"
+    print(f"{args.establishments} establishments x {args.items} items, {mode}{', delta' if args.delta else ''}"
+          f"{', dry run' if args.dry_run else ''} against {url}")
+    print(f"Result files in {config.DATA_DIR}")
+
+    results = []
+    for number in range(1, args.repeat + 1):
+        server_stats(url, reset=True)
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        # Every item prints a line, which would be timed as well if it went to the console
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run(id_list, streaming=not args.batch, delta=args.delta, dry_run=args.dry_run)
+        wall = time.perf_counter() - started
+        heap_peak = None
+        if args.tracemalloc:
+            heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        stats = server_stats(url)
+
+        result = {
+            "run": number,
+            "wall_seconds": round(wall, 3),
+            "fetch_requests": stats.get("get", 0),
+            "fetch_per_sec": round(per_second(stats, "get"), 1),
+            "patch_requests": stats.get("patch", 0),
+            "patch_per_sec": round(per_second(stats, "patch"), 1),
+            "throttled_429": stats.get("429", 0),
+            "errors_500": stats.get("500", 0),
+            "peak_rss_mb": None if (rss := peak_rss_mb()) is None else round(rss, 1),
+            "peak_heap_mb": None if heap_peak is None else round(heap_peak, 1),
+        }
+        results.append(result)
+
+        print(f"\nRun {number}")
+        print(f"  wall time:       {result['wall_seconds']:.2f}s")
+        print(f"  fetch:           {result['fetch_requests']} requests, {result['fetch_per_sec']} req/s")
+        print(f"  patch:           {result['patch_requests']} requests, {result['patch_per_sec']} req/s")
+        print(f"  injected:        {result['throttled_429']} x 429, {result['errors_500']} x 500")
+        if result["peak_rss_mb"] is not None:
+            print(f"  peak RSS:        {result['peak_rss_mb']} MB")
+        if result["peak_heap_mb"] is not None:
+            print(f"  peak heap:       {result['peak_heap_mb']} MB")
+        print(f"  {limiter.summary()}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "results": results}, file, indent=2)
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+''' Local stand-in for the parts of the Revel API the app uses, so a run can be timed without touching the real
+    store data. It answers the four calls made by get_data.py and patch_data.py:
+
+        GET   /enterprise/Establishment/        list of establishments (id, name)
+        GET   /products/ProductCategory/        the 'Catering' and '• Catering' categories, by establishment or
+                                                establishment__in, with their subcategories
+        GET   /resources/Product/               products of one establishment and category, paged with limit/offset
+                                                and meta.next, with 'fields' and 'updated_date__gte' filters
+        PATCH /resources/Product/<id>/          202, and the new combo_upcharge is kept for later GETs
+
+    The fleet is synthetic and built on the fly from the establishment, category and item numbers, so even a
+    120 x 3,048 fleet takes no memory up front. Every request can be slowed down (latency, with some jitter) or
+    fail at random with a 429 (with a Retry-After header) or a 500. GET /__stats__ returns the request counters, and
+    GET /__stats__?reset=1 returns them and starts counting again.
+
+    Usage: python benchmarks/mock_revel_server.py --port 8765 --establishments 120 --latency 0.05
+    Then point config.BASE_URL at http://127.0.0.1:8765 to run the app against it.'''
+
+# Names of the two catering categories, and the two subcategories the app leaves out
+CATERING_CATEGORIES = ["Catering", "• Catering"]
+EXCLUDED_SUBCATEGORIES = ["Catering", "Tray Sides"]
+
+
+class MockFleet:
+    def __init__(self, establishments=120, items=3048, categories=40, mismatch_rate=0.05):
+        self.establishments = establishments
+        self.items = items
+        # At least one subcategory under each of the two catering categories
+        self.categories = max(categories, len(CATERING_CATEGORIES))
+        self.mismatch_rate = mismatch_rate
+        self.created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+        # combo_upcharge and updated_date of every patched product, by product id
+        self.lock = threading.Lock()
+        self.patched = {}
+
+    # Subcategory ids of an establishment, split between the two catering categories
+    def subcategories(self, est, category_name):
+        index = CATERING_CATEGORIES.index(category_name)
+        subcategories = [{"name": name, "id": est * 1000 + index * 2 + offset}
+                         for offset, name in enumerate(EXCLUDED_SUBCATEGORIES)]
+        for number in range(index, self.categories, len(CATERING_CATEGORIES)):
+            subcategories.append({"name": f"Trays {number + 1}", "id": est * 1000 + 100 + number})
+        return subcategories
+
+    # The items of an establishment are spread as evenly as possible over its subcategories
+    def item_range(self, category_id):
+        number = category_id % 1000 - 100
+        if not 0 <= number < self.categories:
+            return range(0)
+        per_category, extra = divmod(self.items, self.categories)
+        start = number * per_category + min(number, extra)
+        return range(start, start + per_category + (1 if number < extra else 0))
+
+    def product(self, est, category_id, item):
+        product_id = est * 100000 + item
+        price = float(5 + item % 40)
+        # A fixed share of the items have an upcharge that doesn't match the price, picked by a hash of the id
+        mismatched = (product_id * 2654435761) % 10000 < self.mismatch_rate * 10000
+        combo_upcharge = f"{price + 1 if mismatched else price:.4f}"
+        updated_date = self.created
+
+        with self.lock:
+            patched = self.patched.get(product_id)
+        if patched is not None:
+            combo_upcharge, updated_date = patched
+
+        return {
+            "id": product_id,
+            "establishment": f"/enterprise/Establishment/{est}/",
+            "name": f"Tray {item}",
+            "attribute_type": 2,
+            "price": price,
+            "combo_upcharge": combo_upcharge,
+            "sorting": item,
+            "updated_by": "/enterprise/User/1/",
+            "variable_pricing_by": 0,
+            "tax_class": 0,
+            "created_by": "/enterprise/User/2/",
+            "category": f"/products/ProductCategory/{category_id}/",
+            "updated_date": updated_date,
+            "description": "Synthetic catering tray from the mock Revel server",
+        }
+
+    def patch(self, product_id, body):
+        updated_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+        with self.lock:
+            self.patched[product_id] = (f"{float(body.get('combo_upcharge', 0)):.4f}", updated_date)
+
+
+class MockRevelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in one write, flushed at the end of each request. Written separately, Nagle's algorithm
+    # and delayed ACKs add ~40ms to every response, which would swamp the latency being measured
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Applies the latency, 429 and error settings. Returns True when the request was failed on purpose
+    def inject(self, kind):
+        server = self.server
+        server.count(kind)
+        if server.latency:
+            time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+        roll = random.random()
+        if roll < server.rate_429:
+            server.count("429")
+            self.send_json({"error": "Too many requests"}, 429, {"Retry-After": str(server.retry_after)})
+            return True
+        if roll < server.rate_429 + server.error_rate:
+            server.count("500")
+            self.send_json({"error": "Internal server error"}, 500)
+            return True
+        return False
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        if parts.path == "/__stats__":
+            return self.send_json(self.server.snapshot(reset=params.get("reset") == "1"))
+        if self.inject("get"):
+            return
+
+        fleet = self.server.fleet
+        if parts.path == "/enterprise/Establishment/":
+            objects = [{"id": est, "name": f"Mock Store {est}"} for est in range(1, fleet.establishments + 1)]
+        elif parts.path == "/products/ProductCategory/":
+            ests = params.get("establishment__in", params.get("establishment", ""))
+            name = params.get("name")
+            if name not in CATERING_CATEGORIES:
+                objects = []
+            else:
+                objects = [{"id": int(est) * 1000 + 900 + CATERING_CATEGORIES.index(name), "name": name,
+                            "establishment": f"/enterprise/Establishment/{est}/",
+                            "subcategories": fleet.subcategories(int(est), name)}
+                           for est in ests.split(",") if est]
+        elif parts.path == "/resources/Product/":
+            est = int(params.get("establishment", 0))
+            category_id = int(params.get("category", 0))
+            objects = [fleet.product(est, category_id, item) for item in fleet.item_range(category_id)]
+            since = params.get("updated_date__gte")
+            if since:
+                objects = [obj for obj in objects if obj["updated_date"] >= since]
+        else:
+            return self.send_json({"error": "Not found"}, 404)
+
+        # Paging the same way the API does, with limit/offset and a link to the next page in meta.next
+        limit = int(params.get("limit", 20))
+        offset = int(params.get("offset", 0))
+        page = objects[offset:offset + limit]
+        next_link = None
+        if offset + limit < len(objects):
+            next_link = f"{parts.path}?{urlencode(dict(params, offset=offset + limit))}"
+
+        fields = params.get("fields")
+        if fields:
+            keep = set(fields.split(","))
+            page = [{key: value for key, value in obj.items() if key in keep} for obj in page]
+
+        self.send_json({"meta": {"limit": limit, "offset": offset, "total_count": len(objects), "next": next_link},
+                        "objects": page})
+
+    def do_PATCH(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.inject("patch"):
+            return
+        path = urlsplit(self.path).path.strip("/").split("/")
+        if len(path) != 3 or path[:2] != ["resources", "Product"]:
+            return self.send_json({"error": "Not found"}, 404)
+        self.server.fleet.patch(int(path[2]), json.loads(body or b"{}"))
+        self.send_json({}, 202)
+
+
+class MockRevelServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The app keeps a few dozen connections open at once, more than the default backlog of 5
+    request_queue_size = 256
+
+    def __init__(self, port=0, fleet=None, latency=0.0, jitter=0.5, rate_429=0.0, error_rate=0.0, retry_after=1):
+        super().__init__(("127.0.0.1", port), MockRevelHandler)
+        self.fleet = fleet or MockFleet()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+        # Request counters, along with the time of the first and last GET and PATCH
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, kind):
+        now = time.time()
+        with self.stats_lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+            self.stats.setdefault(f"{kind}_first", now)
+            self.stats[f"{kind}_last"] = now
+
+    def snapshot(self, reset=False):
+        with self.stats_lock:
+            stats = dict(self.stats)
+            if reset:
+                self.stats = {}
+            return stats
+
+    # Serves on a background thread
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the Revel API endpoints used by the app.")
+    add_server_args(parser)
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default 8765)")
+    return parser.parse_args(argv)
+
+
+# Fleet and fault injection options, shared with bench_end_to_end.py
+def add_server_args(parser):
+    parser.add_argument("--establishments", type=int, default=120, help="number of establishments (default 120)")
+    parser.add_argument("--items", type=int, default=3048, help="catering items per establishment (default 3048)")
+    parser.add_argument("--categories", type=int, default=40,
+                        help="catering subcategories per establishment (default 40)")
+    parser.add_argument("--mismatch-rate", type=float, default=0.05,
+                        help="share of items whose upcharge doesn't match the price (default 0.05)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request (default 0)")
+    parser.add_argument("--rate-429", type=float, default=0.0,
+                        help="share of requests answered with a 429 (default 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests answered with a 500 (default 0)")
+    parser.add_argument("--seed", type=int, help="seed for the latency jitter and injected failures")
+
+
+# Builds a server from the parsed options
+def server_from_args(args, port=0):
+    if args.seed is not None:
+        random.seed(args.seed)
+    fleet = MockFleet(args.establishments, args.items, args.categories, args.mismatch_rate)
+    return MockRevelServer(port, fleet, latency=args.latency, rate_429=args.rate_429, error_rate=args.error_rate)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = server_from_args(args, args.port)
+    print(f"Mock Revel API on {server.url} ({args.establishments} establishments x {args.items} items)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+from config import CATEGORY_CACHE_FILE, CATEGORY_CACHE_TTL_HOURS, data_path
+
+
+''' Cache of the subcategory names and ids of each establishment's catering categories. These almost never change, so
+    after the first run the two category lookups per establishment are answered from a json file in the data folder
+    instead of the API. Each entry expires after CATEGORY_CACHE_TTL_HOURS, and invalidate() clears entries by hand
+    when a menu has been reworked (cli.py --refresh-categories).
+
+    Entries hold the full subcategory list as returned by the API. The 'Catering'/'Tray Sides' exclusion is still
+    applied to it every time it is used, same as a live lookup.'''
+
+
+class CategoryCache:
+    def __init__(self, path=None, ttl_hours=CATEGORY_CACHE_TTL_HOURS):
+        self.path = path or data_path(CATEGORY_CACHE_FILE)
+        self.ttl = ttl_hours * 3600
+        # Lookups come from every fetch worker, so reads and writes go through a lock
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.reset_stats()
+        self.load()
+
+    # Clears the hit/miss counters at the start of a run
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.batched_calls = 0
+
+    # Entries are stored under "est|category name"
+    @staticmethod
+    def key(est, category_name):
+        return f"{est}|{category_name}"
+
+    # Reads the cache file from disk, starting empty if there isn't one (or it can't be read)
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    # Writes the cache to disk. Written to a temp file first so a crash can't leave a half written cache behind
+    def save(self):
+        with self.lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+    # Returns the cached list of {"name", "id"} subcategories, or None when it isn't cached or has expired
+    def get(self, est, category_name):
+        with self.lock:
+            entry = self.entries.get(self.key(est, category_name))
+            if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry["subcategories"]
+
+    # Stores the list of {"name", "id"} subcategories of a category
+    def put(self, est, category_name, subcategories):
+        with self.lock:
+            self.entries[self.key(est, category_name)] = {"fetched_at": time.time(), "subcategories": subcategories}
+
+    # Drops the cached categories of the given establishments, or everything when no list is given
+    def invalidate(self, id_list=None):
+        with self.lock:
+            if id_list is None:
+                self.entries = {}
+            else:
+                prefixes = tuple(f"{est}|" for est in id_list)
+                self.entries = {key: entry for key, entry in self.entries.items() if not key.startswith(prefixes)}
+
+    # Hit rate line for the run output
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return (f"Category cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), "
+                f"{self.batched_calls} batch lookups")
+
+
+# The cache is loaded on first use, and loaded again from the new folder whenever the data folder has changed
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Returns the shared category cache for the current data folder
+def get_category_cache():
+    global _cache
+    path = data_path(CATEGORY_CACHE_FILE)
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            _cache = CategoryCache(path)
+        return _cache
@@ -0,0 +1,162 @@
+import argparse
+import os
+import sys
+import threading
+import config
+
+
+''' Command line entry point for running the upcharge patch without the GUI, e.g. from a scheduled task or cron job.
+
+    python cli.py all                        Patch every establishment
+    python cli.py 3 17 42                    Patch the listed establishment ids
+    python cli.py all --dry-run              Fetch and check only, nothing is patched
+    python cli.py all --workers 16 --output-dir /var/log/upcharge
+    python cli.py all --format parquet       Write the result files as Parquet instead of csv
+    python cli.py --resume                   Pick up the last run where it was stopped
+    python cli.py 3 17 --refresh-categories  Look the category ids of 3 and 17 up again instead of using the cache
+    python cli.py all --delta --full-resync  Clear the delta snapshot first, so every item is fetched and checked
+
+    Only argparse and config are imported up front, so --help and argument errors come back straight away. pandas,
+    requests and the rest of the run are imported once the arguments are known to be good.'''
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Patch the combo upcharge of catering trays to match their price, without the GUI."
+    )
+    parser.add_argument("establishments", nargs="*",
+                        help="establishment ids to patch, or 'all' for every establishment")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="fetch and check the items, but don't patch anything")
+    parser.add_argument("--workers", type=int,
+                        help=f"max requests in flight for fetch and patch (default {config.MAX_CONCURRENCY})")
+    parser.add_argument("--output-dir",
+                        help=f"folder the csv and log files are written to (default {config.DATA_DIR})")
+    parser.add_argument("--delta", action="store_true", default=config.DELTA_RUNS,
+                        help="only check items that are new or changed since the last run")
+    parser.add_argument("--batch", action="store_true",
+                        help="fetch everything before checking and patching, instead of streaming")
+    parser.add_argument("--format", choices=["csv", "csv.gz", "parquet", "feather"], default=config.RESULT_FORMAT,
+                        help=f"format of the result files (default {config.RESULT_FORMAT})")
+    parser.add_argument("--resume", action="store_true",
+                        help="pick up the last run where it was stopped, instead of starting a new one")
+    parser.add_argument("--refresh-categories", action="store_true",
+                        help="drop the cached category ids of the establishments being run and look them up again")
+    parser.add_argument("--full-resync", action="store_true",
+                        help="clear the delta snapshot of the establishments being run, so they are fetched in full")
+    parser.add_argument("--minimal-payload", action="store_true",
+                        help="send only combo_upcharge in the patch body instead of the full 11 fields")
+    parser.add_argument("--trace", action="store_true",
+                        help=f"time every request and step, and write a Chrome trace to {config.TRACE_FILE}")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print the progress line and the summary, not a line per item")
+    args = parser.parse_args(argv)
+
+    # A resumed run takes its establishments from the journal of the last run
+    if args.resume:
+        if args.establishments:
+            parser.error("--resume takes its establishments from the last run, don't list any")
+        if args.dry_run:
+            parser.error("--resume can't be combined with --dry-run")
+        return args
+    if not args.establishments:
+        parser.error("establishments are required, either 'all' or a list of establishment ids")
+
+    # Either 'all' on its own, or a list of establishment ids
+    if args.establishments != ["all"]:
+        try:
+            args.establishments = [int(est) for est in args.establishments]
+        except ValueError:
+            parser.error("establishments must be 'all' or a list of establishment ids")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+# Keeps only the lines that aren't per item updates, used by --quiet
+class QuietStream:
+    ''' print() writes the text and the line ending separately, and workers print at the same time, so each thread
+    builds up its own line and it is only checked once the line is complete.'''
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffered = getattr(self.local, "buffer", "") + text
+        *lines, self.local.buffer = buffered.split("\n")
+        for line in lines:
+            if not line.startswith("Updated product "):
+                self.stream.write(line + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run(argv=None):
+    args = parse_args(argv)
+
+    ''' Settings are changed on config before the rest of the app is imported, since the modules read their
+    defaults from config as they are imported.'''
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        config.DATA_DIR = args.output_dir
+    if args.workers:
+        config.MAX_WORKERS = args.workers
+        config.PATCH_WORKERS = args.workers
+        config.MAX_CONCURRENCY = args.workers
+        config.INITIAL_CONCURRENCY = min(config.INITIAL_CONCURRENCY, args.workers)
+    config.RESULT_FORMAT = args.format
+    if args.trace:
+        config.TRACING = True
+    if args.minimal_payload:
+        config.PATCH_MINIMAL_PAYLOAD = True
+    if args.quiet:
+        sys.stdout = QuietStream(sys.stdout)
+
+    from main import main
+    from http_client import close_session
+    from progress import progress, format_progress, ConsoleProgressReporter
+
+    # 'all' is resolved to every establishment id from the API
+    if args.resume:
+        id_list = []
+    elif args.establishments == ["all"]:
+        from get_data import get_est_list
+        id_list = list(get_est_list().values())
+    else:
+        id_list = args.establishments
+    if not args.resume:
+        print(f"Running for {len(id_list)} establishments{' (dry run)' if args.dry_run else ''}")
+
+    # Clears the cached category ids so they are looked up again, for every establishment on 'all' or a resumed run
+    if args.refresh_categories:
+        from category_cache import get_category_cache
+        cache = get_category_cache()
+        cache.invalidate(id_list if args.establishments != ["all"] and not args.resume else None)
+        cache.save()
+
+    # Clears the delta snapshot the same way, so the next delta run fetches and checks every item again
+    if args.full_resync:
+        from snapshot_store import SnapshotStore
+        store = SnapshotStore()
+        store.invalidate(id_list if args.establishments != ["all"] and not args.resume else None)
+        store.close()
+
+    # Print a progress line every few seconds, and a final one at the end of the run
+    reporter = ConsoleProgressReporter()
+    progress.subscribe(reporter)
+    try:
+        main(id_list, streaming=not args.batch, delta=args.delta, dry_run=args.dry_run, resume=args.resume)
+    finally:
+        # Stop reporting and close the pooled connections before exiting
+        progress.unsubscribe(reporter)
+        close_session()
+    snapshot = progress.snapshot()
+    print(format_progress(snapshot))
+
+    # A non-zero exit code lets a scheduler flag the run when establishments or patches failed
+    return 1 if snapshot["establishments_failed"] or snapshot["patches_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,3 +1,7 @@
+import pandas as pd
+from config import PRICE_TOLERANCE
+
+
 # Condition check to see if 'price' does not equal 'combo_upcharge'
 def check_if_item_needs_patch(row):
     try:
@@ -6,4 +10,18 @@ def check_if_item_needs_patch(row):
         return price != combo_upcharge
     except ValueError:
         return False
-    
\ No newline at end of file
+
+
+# Vectorized version of the condition check. Returns a boolean mask over the whole dataframe in one pass
+def items_needing_patch(df, tolerance=PRICE_TOLERANCE):
+    # Nothing to compare on an empty dataframe (it may not even have the columns)
+    if df.empty:
+        return pd.Series(False, index=df.index, dtype=bool)
+
+    ''' to_numeric with errors='coerce' turns anything that can't be read as a number into NaN. Any comparison with
+    NaN is False, so an unreadable price or upcharge is never patched, same as the ValueError in the row check.'''
+    price = pd.to_numeric(df['price'], errors='coerce')
+    combo_upcharge = pd.to_numeric(df['combo_upcharge'], errors='coerce')
+
+    # An item needs a patch when the two values are further apart than the tolerance
+    return (price - combo_upcharge).abs() > tolerance
@@ -1,5 +1,109 @@
-# Max workers that will run in parallel when making calls to the API
-MAX_WORKERS = 8
+import os
+
+# Max workers that will run in parallel when making calls to the API. This is a ceiling, the number of requests
+# actually in flight is set by the adaptive limiter below
+MAX_WORKERS = 32
+
+# Max workers that will send PATCH requests in parallel. Kept separate from MAX_WORKERS so the patch stage can be
+# tuned on its own, since a full fleet patch is thousands of requests compared to a few hundred GET calls
+PATCH_WORKERS = 32
+
+# Number of establishments being fetched at the same time. Each one queues a call per category, so a few is
+# enough to keep every worker busy while still finishing establishments one after another
+FETCH_EST_WINDOW = 8
+
+# Shared request budget for fetch and patch (rate_limiter.py). Requests per second start capped at RATE_LIMIT_PER_SEC
+# (bursts of up to RATE_LIMIT_BURST) and rise towards MAX_RATE_LIMIT_PER_SEC while the API is healthy. Requests in
+# flight start at INITIAL_CONCURRENCY, go up by one while the API stays healthy and are halved on a 429, a 5xx or a
+# response slower than LATENCY_SPIKE_FACTOR times the usual for its endpoint
+RATE_LIMIT_PER_SEC = 40
+MAX_RATE_LIMIT_PER_SEC = 400
+RATE_LIMIT_BURST = 20
+MIN_CONCURRENCY = 2
+MAX_CONCURRENCY = 32
+INITIAL_CONCURRENCY = 8
+LATENCY_SPIKE_FACTOR = 3
+
+# Number of times a request that got a 429 (too many requests) is sent again, after waiting out its Retry-After
+RATE_LIMIT_RETRIES = 5
+
+# Base URL for the Revel API. Every endpoint used by the app is built off of this
+BASE_URL = 'https://primohoagies.revelup.com'
+
+# Seconds to wait for a connection to open and for the server to answer. Keeps a hung socket from holding a worker
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Number of times a GET is retried on a 5xx or connection error, and the backoff factor between attempts
+# (0.5s, 1s, 2s...)
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+
+# Folder that every csv/log file from a run is written to
+DATA_DIR = 'data_files'
+
+# Run the fetch, condition check and patch stages as a streaming pipeline, so each establishment is checked and
+# patched as soon as its data comes in instead of waiting for the whole fleet to download first
+STREAMING = True
+
+# Number of establishments that can be waiting between two stages of the streaming pipeline. Keeps memory flat
+STREAM_QUEUE_SIZE = 4
+
+# Delta runs compare each fetch against a local snapshot of the last run (SNAPSHOT_DB in the data folder) and only
+# check/patch items that are new, changed, or still needed a patch last time
+DELTA_RUNS = False
+SNAPSHOT_DB = 'snapshot.sqlite3'
+
+# On delta runs, ask the API for only the products updated since the last fetch of each establishment. The overlap
+# steps back from the last fetch time, so clock or timezone differences can't cause an update to be missed
+DELTA_SERVER_FILTER = True
+DELTA_OVERLAP_HOURS = 24
+
+# Subcategory ids of each establishment's catering categories are cached in this file in the data folder, and looked
+# up again after CATEGORY_CACHE_TTL_HOURS. Anything not cached is looked up CATEGORY_BATCH_SIZE establishments per call
+CATEGORY_CACHE_FILE = 'category_cache.json'
+CATEGORY_CACHE_TTL_HOURS = 24 * 7
+CATEGORY_BATCH_SIZE = 20
+
+# Last establishment list pulled from the API, kept in the data folder so the GUI can open without waiting on it
+EST_LIST_CACHE_FILE = 'est_list.json'
+
+# The GUI output console is refreshed every CONSOLE_FLUSH_MS milliseconds and only keeps the last CONSOLE_MAX_LINES
+# lines. The full output goes to LOG_FILE in the data folder, rolled over at LOG_MAX_BYTES with LOG_BACKUP_COUNT old
+# files
+CONSOLE_FLUSH_MS = 100
+CONSOLE_MAX_LINES = 2000
+LOG_FILE = 'upcharge.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# How often (milliseconds) the GUI redraws the progress bar and status line during a run
+PROGRESS_REFRESH_MS = 250
+
+# Number of objects asked for per page on the product and category calls. Every page is followed to the end, so this
+# only trades the number of calls against the size (and memory) of each one
+PRODUCT_PAGE_SIZE = 1000
+CATEGORY_PAGE_SIZE = 40
+
+# Format of the result files (products_data_, products_data_filtered, passed_items, failed_items). One of 'csv',
+# 'csv.gz', 'parquet' or 'feather'. Parquet and Feather need pyarrow installed and are much faster to load back into
+# pandas than csv
+RESULT_FORMAT = 'csv'
+# Patch results are written out in batches of this many rows
+RESULT_ROW_BUFFER = 500
+
+# Journal of the current run in the data folder, used to resume a run that was stopped partway (see journal.py)
+JOURNAL_FILE = 'run_journal.jsonl'
+
+# Times every request and step of a run (tracing.py). The spans are written to TRACE_FILE in the data folder as a
+# Chrome trace, and a summary of where the time went is printed at the end of the run
+TRACING = False
+TRACE_FILE = 'trace.json'
+
+# Send only combo_upcharge in the patch body instead of the full 11 field body (see patch_planner.py). An item whose
+# minimal body is turned down with a 400 is sent again with the full body. Off until it's been checked against the
+# real API, since the documentation lists every field of DESIRED_COLUMNS as required
+PATCH_MINIMAL_PAYLOAD = False
 
 # API key that is being passed on each call to an endpoint through the 'headers' dict
 API_KEY = 'API_KEY'
@@ -11,9 +115,18 @@ HEADERS = {
     "content-type": "application/json"
 }
 
+# Largest difference between 'price' and 'combo_upcharge' that still counts as equal. The API stores the upcharge to
+# 4 decimal places ("1.0000" vs "1.0"), so anything under half of the last place is treated as the same value
+PRICE_TOLERANCE = 0.00005
+
 # Required variables for the PATCH based on Revel API documentation. We need all of these per item
 DESIRED_COLUMNS = [
     'combo_upcharge', 'id', 'establishment', 'name', 'attribute_type',
     'price', 'sorting', 'updated_by', 'variable_pricing_by',
     'tax_class', 'created_by', 'category'
 ]
+
+
+# Builds the path to a file in the data folder. DATA_DIR is read at call time so it can be changed before a run
+def data_path(filename):
+    return os.path.join(DATA_DIR, filename)
@@ -0,0 +1,26 @@
+import json
+import os
+from config import EST_LIST_CACHE_FILE, data_path
+
+
+''' The last establishment list pulled from the API (get_data.get_est_list) is kept on disk, so the GUI can show it
+    straight away on start up while the live list loads in the background. Kept out of get_data.py so reading it
+    doesn't pull in pandas and requests.'''
+
+
+# Reads the establishment list saved by the last successful get_est_list call. Empty dict if there isn't one yet
+def load_cached_est_list():
+    try:
+        with open(data_path(EST_LIST_CACHE_FILE), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Saves the establishment list to disk, so the GUI can show it straight away on the next start
+def save_est_list_cache(est_data):
+    path = data_path(EST_LIST_CACHE_FILE)
+    # Written to a temp file first so a crash can't leave a half written list behind
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(est_data, file, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
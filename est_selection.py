@@ -0,0 +1,64 @@
+''' Which establishments are selected in the GUI, kept apart from the widgets that show them. The list in the window
+    only draws the rows that are on screen (see EstablishmentList in GUI.py), so the selection can't live on the
+    switches themselves. Selecting everything, clearing it, and building the id_list for a run all work on this model
+    without touching a single widget, so they stay instant with thousands of establishments.
+
+    The search box filters the list on name and id. Every establishment has a lowercase "name id" search key built
+    once when the list is loaded, and a search that only adds to the last one (typing another letter) only has to look
+    through the previous matches.'''
+
+
+class EstablishmentSelection:
+    def __init__(self, est_data=None):
+        self.set_establishments(est_data or {})
+
+    # Loads a new {name: id} list, keeping any establishment that was selected and is still in it
+    def set_establishments(self, est_data):
+        previous = getattr(self, "selected", set())
+        self.names = list(est_data.keys())
+        self.ids = list(est_data.values())
+        self.index_of_id = {est_id: index for index, est_id in enumerate(self.ids)}
+        self.search_keys = [f"{name.lower()} {est_id}" for name, est_id in est_data.items()]
+        # Selected establishment ids
+        self.selected = {est_id for est_id in previous if est_id in self.index_of_id}
+        # The last search and the positions it matched, so the next one can start from there
+        self.query = ""
+        self.matches = list(range(len(self.names)))
+
+    def __len__(self):
+        return len(self.names)
+
+    ''' SEARCH '''
+    # Positions of the establishments matching the search, in list order. Every word has to appear in the name or id
+    def filter(self, query):
+        query = query.strip().lower()
+        if query == self.query:
+            return self.matches
+
+        # Typing on from the last search can only narrow it down, so only its matches need checking
+        candidates = self.matches if self.query and query.startswith(self.query) else range(len(self.names))
+        words = query.split()
+        self.matches = [index for index in candidates if all(word in self.search_keys[index] for word in words)]
+        self.query = query
+        return self.matches
+
+    ''' SELECTION '''
+    def is_selected(self, index):
+        return self.ids[index] in self.selected
+
+    def set_selected(self, index, selected):
+        if selected:
+            self.selected.add(self.ids[index])
+        else:
+            self.selected.discard(self.ids[index])
+
+    def select_all(self):
+        self.selected = set(self.ids)
+
+    def clear(self):
+        self.selected = set()
+
+    # Selected (name, id) pairs in list order, for the run
+    def selected_items(self):
+        return [(self.names[index], self.ids[index]) for index in sorted(self.index_of_id[est_id]
+                                                                         for est_id in self.selected)]
@@ -1,91 +1,276 @@
+import time
 import pandas as pd
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from config import MAX_WORKERS, DESIRED_COLUMNS, HEADERS
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from category_cache import get_category_cache
+from condition_check import items_needing_patch
+from config import (MAX_WORKERS, FETCH_EST_WINDOW, DESIRED_COLUMNS, DELTA_SERVER_FILTER, CATEGORY_BATCH_SIZE,
+                    PRODUCT_PAGE_SIZE, CATEGORY_PAGE_SIZE)
+from http_client import api_get, decode_json, iter_pages
+from progress import progress
+from records import ProductRecords, concat_records
+from snapshot_store import SnapshotStore, snapshot_time
+from tracing import tracer
 
+# The two catering categories we pull trays from. '• Catering' is the online ordering menu
+CATERING_CATEGORIES = ["Catering", "• Catering"]
 
-# Takes two parameters, establishment number as int and category name. Pulls all items from the categories
-def get_category_data(establishment, category_name):
-    # Endpoint
-    url = "https://primohoagies.revelup.com/products/ProductCategory/"
+# Fields asked for on the category and product calls, so only what we use comes back over the wire
+CATEGORY_FIELDS = "establishment,subcategories"
+PRODUCT_FIELDS = ",".join(DESIRED_COLUMNS)
 
-    # Passing the supplied variables to request through query string along with a limit
-    querystring = {"establishment": establishment, "name": category_name, "limit": 40}
 
-    response = requests.request("GET", url, headers=HEADERS, params=querystring)
+# Takes two parameters, establishment number as int and category name. Pulls all items from the categories. Returns
+# None when the API has no category by that name for the establishment
+def get_category_data(establishment, category_name):
+    # Passing the supplied variables to request through query string along with a limit
+    querystring = {"establishment": establishment, "name": category_name, "limit": CATEGORY_PAGE_SIZE,
+                   "fields": CATEGORY_FIELDS}
 
     ''' Getting the name of the item and the product ID associated with it from the endpoint '''
-    # Converting the data from response into JSON
-    data = response.json()
-    # Getting the 'subcategories' from the JSON, nested within the 'objects' key
-    subcategories = data.get("objects", [{}])[0].get("subcategories", [])
+    # Only the first category object is used, so only the first page is needed
+    with tracer.span("get_category_data", "fetch", est=establishment, category=category_name):
+        category = next(iter_pages("/products/ProductCategory/", querystring), None)
+    if category is None:
+        return None
+    # Getting the 'subcategories' from the JSON, nested within the category object
+    subcategories = category.get("subcategories", [])
 
     # Creating a list of name: 'item name' , id: 'item id' that we are going to return to the main function
     # For each category in subcategories, create an entry where name is 'name' and id is 'id'.
     name_id_list = [{"name": category["name"], "id": category["id"]} for category in subcategories]
 
     # Return the list
-    return pd.DataFrame(name_id_list)
+    return pd.DataFrame(name_id_list, columns=["name", "id"])
+
+
+# Looks up a category for several establishments in one call. Returns a dict of est number: list of subcategories
+def get_category_data_batch(id_list, category_name):
+    # establishment__in filters on a comma separated list of establishment ids, one category object comes back per est
+    querystring = {"establishment__in": ",".join(str(est) for est in id_list), "name": category_name,
+                   "limit": CATEGORY_PAGE_SIZE, "fields": CATEGORY_FIELDS}
+
+    # Group the subcategories by the establishment they belong to, given as a link like '/enterprise/Establishment/3/'
+    subcategories_by_est = {}
+    with tracer.span("get_category_data_batch", "fetch", establishments=len(id_list), category=category_name):
+        for obj in iter_pages("/products/ProductCategory/", querystring):
+            establishment = obj.get("establishment")
+            if not establishment:
+                continue
+            est = int(str(establishment).rstrip("/").split("/")[-1])
+            # Same as the single lookup, the first category object of each establishment is the one used
+            if est in subcategories_by_est:
+                continue
+            subcategories_by_est[est] = [{"name": category["name"], "id": category["id"]}
+                                         for category in obj.get("subcategories", [])]
+
+    return subcategories_by_est
+
+
+# Finds the catering subcategories of every establishment, from the cache first, then in batches from the API
+def resolve_categories(id_list, executor):
+    ''' Returns a dict where the key is (est number, category name) and the value is the list of subcategories.
+    Anything not in the cache is looked up CATEGORY_BATCH_SIZE establishments at a time on the executor. If a batch
+    call fails, or an establishment is missing from its result, that establishment is left out of the dict and its
+    categories are looked up on their own when it is processed.'''
+    cache = get_category_cache()
+    cache.reset_stats()
+    resolved = {}
+    jobs = []
+    for category_name in CATERING_CATEGORIES:
+        cold = []
+        for est in id_list:
+            subcategories = cache.get(est, category_name)
+            if subcategories is None:
+                cold.append(est)
+            else:
+                resolved[(est, category_name)] = subcategories
+        # Split the establishments that missed the cache into batches
+        jobs.extend((cold[i:i + CATEGORY_BATCH_SIZE], category_name) for i in range(0, len(cold), CATEGORY_BATCH_SIZE))
 
+    # Runs one batch, handing back an empty result if the call fails so the establishments fall back to single lookups
+    def run_batch(job):
+        chunk, category_name = job
+        try:
+            return get_category_data_batch(chunk, category_name)
+        except Exception as exc:
+            print(f"\nBatch category lookup for '{category_name}' failed, looking up one at a time: {exc}")
+            return {}
 
-# Get the data on the products given the establishment and the product id
-def get_product_data(est, cat_id):
-    url = 'https://primohoagies.revelup.com/resources/Product/'
+    for (chunk, category_name), result in zip(jobs, executor.map(run_batch, jobs)):
+        cache.batched_calls += 1
+        for est in chunk:
+            if est in result:
+                cache.put(est, category_name, result[est])
+                resolved[(est, category_name)] = result[est]
+
+    return resolved
+
+
+# Get the data on the products given the establishment and the product id. updated_since only asks for recent changes
+def iter_product_data(est, cat_id, updated_since=None, page_size=PRODUCT_PAGE_SIZE):
     # Passing the 'est' and 'cat_id' in to the parameters on the call
-    params = {"establishment": est, "category": cat_id, "limit": 1000}
-    response = requests.get(url, headers=HEADERS, params=params)
+    # 'fields' asks the API to only send the columns we use, instead of the full Product object
+    params = {"establishment": est, "category": cat_id, "limit": page_size, "fields": PRODUCT_FIELDS}
+    if updated_since is not None:
+        params["updated_date__gte"] = updated_since
+    response = api_get('/resources/Product/', params=params)
 
-    # Returning the response from the endpoint as JSON data
-    return response.json()
+    # If the API won't take the updated filter, ask again for everything. The snapshot diff sorts out what changed
+    if updated_since is not None and response.status_code == 400:
+        del params["updated_date__gte"]
+        response = api_get('/resources/Product/', params=params)
+
+    # Yielding every product in the category, following the pages from the first response
+    yield from iter_pages('/resources/Product/', params, response)
 
 
 # Getting data from multiple endpoints (establishments) in parallel to speed up the operation
-def fetch_data_in_parallel(id_list):
-    # Empty list that we will use to keep all data
-    all_product_data = []
-
-    # Setting a ThreadPoolExecutor with max_workers (defined in config) as 'executor'
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        ''' Using a thread pool to handle running these sequentially. Opting to hold these future objects in a dict
-         so we can quickly reference the establishment number for print statement within this function. Otherwise,
-         we would have to return this value from the process_establishment_data function. Could easily be held in a 
-         list as well, but this is why I chose to design it like this. 
-         
-         future_pool is a dict object where the key is a call to the executors(ThreadPool name defined on creation)
-         submit function. The submit function creates a future object, which we are linking to the 
-         process_establishment_data function. This function takes one argument for the establishment number, passed
-         in after the call to the function. We are creating a key value pair for each establishment within the id_list, 
-         where the key is the future object and the value is the establishment number.'''
-        future_pool = {executor.submit(process_establishment_data, est): est for est in id_list}
-
-        ''' All futures run once they called the submit function. as_completed will let us know when the future is 
-        finished running. This will also free up another worker for the next future to be created. So, for each future 
-        that has completed in the future_pool...'''
-        for future in as_completed(future_pool):
-            # Get the value that is assigned to the key (est number)
-            est = future_pool[future]
-            try:
-                # If the pool ran successfully, the returned data can be accessed from the future with .result()
-                data = future.result()
-                ''' We then take that data and extend it to the data list. Using extend because append would create a 
-                list of lists. We want a singular list of items, which extend accommodates. [1,2,3] instead of 
-                 [[1], [2,3]] for example. We want all data merged as it comes into pool from each future.'''
-                all_product_data.extend(data)
-                # Output the result, referencing which est has finished as it finishes
-                print(f"\nData collection completed for establishment: {est}")
-            except Exception as exc:
-                # If there is an exception, we output the exception and the est
-                print(f"\nEstablishment {est} generated an exception: {exc}")
-
-    # Once finished, we return all the product data
-    return all_product_data
-
-
-# Takes establishment number as parameter. Calls get on catering options, filters out dirty data. Merges data into df
-def process_establishment_data(est):
+def fetch_data_in_parallel(id_list, delta=False, writer=None, fetched=None, journal=None):
+    # Empty list that we will use to keep the dataframe of each establishment
+    frames = []
+
+    # Each establishment is handed back by the scheduler as soon as every one of its product calls has finished
+    establishments = iter_delta_establishment_data(id_list) if delta else iter_establishment_data(id_list)
+    for est, data in establishments:
+        frames.append(data)
+        # Written out as each establishment comes in when a result writer is passed (see result_writers.py)
+        if writer is not None:
+            writer.write_frame(data)
+        # Keeps track of which establishments made it, when a list is passed for it
+        if fetched is not None:
+            fetched.append(est)
+        # Each establishment is journaled as soon as it is in, so a run that dies partway through the fetch doesn't
+        # have to download it again when it is resumed (journal.py)
+        if journal is not None:
+            journal.checked([est], data[items_needing_patch(data)])
+
+    # Once finished, we return all the product data merged into one dataframe (see records.py)
+    return concat_records(frames)
+
+
+# Schedules every product call for the selected establishments on one shared pool. Yields (est, df) as each finishes
+def iter_establishment_data(id_list, max_workers=MAX_WORKERS, updated_since=None):
+    ''' Every (establishment, category) product call is submitted to the pool as its own task, instead of one worker
+    walking through all the categories of a store one after another. That way a few large establishments still
+    keep every worker busy.
+
+    Establishments are let into the pool a few at a time (FETCH_EST_WINDOW). Each one first has its category ids
+    resolved, which then queues up one task per category. Holding the number of open establishments down means
+    stores finish one after another as the run goes, instead of all of them finishing at the very end.
+
+    pending is a dict where the key is the future object and the value is a tuple of the kind of call and the
+    establishment number, so we know what to do with the result when the future completes.
+
+    updated_since is an optional dict of establishment number to a timestamp. When an establishment has one, only
+    the products updated since then are asked for.'''
+    updated_since = updated_since or {}
+    est_queue = iter(id_list)
+    pending = {}
+    # Number of product calls still outstanding per establishment, and the data collected for it so far
+    remaining = {}
+    collected = {}
+    # Establishments that raised an exception. Any of their calls still in the pool are ignored when they finish
+    failed = set()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    cache = get_category_cache()
+
+    # When each establishment was let in, for its span in the trace (tracing.py)
+    admitted = {}
+
+    # Submits the category lookup for the next establishment in the list, if there is one left
+    def admit_next():
+        est = next(est_queue, None)
+        if est is not None:
+            admitted[est] = time.perf_counter_ns()
+            pending[executor.submit(get_establishment_category_ids, est, resolved)] = ("categories", est)
+
+    try:
+        # Category ids come from the cache where possible, the rest are looked up in batches before the fetch starts
+        resolved = resolve_categories(id_list, executor)
+
+        for _ in range(FETCH_EST_WINDOW):
+            admit_next()
+
+        # Keep going until every submitted call has finished
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, est = pending.pop(future)
+                # Skip anything left over from an establishment that already failed
+                if est in failed:
+                    continue
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    # If there is an exception, we output the exception and the est, then let the next one in
+                    print(f"\nEstablishment {est} generated an exception: {exc}")
+                    failed.add(est)
+                    progress.emit("requests_dropped", count=remaining.pop(est, 0))
+                    progress.emit("establishment_done", failed=True)
+                    collected.pop(est, None)
+                    admit_next()
+                    continue
+
+                if kind == "categories":
+                    # Queue a product call for every category id, each one is its own task in the pool
+                    remaining[est] = len(result)
+                    collected[est] = ProductRecords()
+                    progress.emit("requests_queued", count=len(result))
+                    for cat_id in result:
+                        future = executor.submit(get_product_records, est, cat_id, updated_since.get(est))
+                        pending[future] = ("products", est)
+                else:
+                    collected[est].extend(result)
+                    remaining[est] -= 1
+                    progress.emit("request_done")
+
+                # Once all the product calls for an establishment have come back, it is finished
+                if remaining.get(est) == 0:
+                    del remaining[est]
+                    # Output the result, referencing which est has finished as it finishes
+                    print(f"\nData collection completed for establishment: {est}")
+                    progress.emit("establishment_done")
+                    admit_next()
+                    with tracer.span("build_frame", "fetch", est=est):
+                        data = collected.pop(est).to_frame()
+                    tracer.record("establishment", "fetch", admitted.pop(est), time.perf_counter_ns(), {"est": est})
+                    yield est, data
+    finally:
+        # If the caller stops early, drop anything that has not started yet
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Keep the categories looked up during this run for the next one
+        cache.save()
+        print(f"\n{cache.summary()}")
+
+
+# Gets the subcategories of a category for one establishment as a dataframe, from resolved, the cache, or the API
+def get_cached_category_data(est, category_name, resolved=None):
+    cache = get_category_cache()
+    # resolved holds what resolve_categories already found for this run. Without it, check the cache directly
+    if resolved is not None:
+        subcategories = resolved.get((est, category_name))
+    else:
+        subcategories = cache.get(est, category_name)
+
+    if subcategories is not None:
+        return pd.DataFrame(subcategories, columns=["name", "id"])
+
+    # Not cached, so look it up and keep it for next time
+    df = get_category_data(est, category_name)
+    ''' Nothing is cached when no category came back. An empty entry would have the establishment quietly fetch no
+    products until it expires, so it is reported as failed instead, and the category is looked up again next run.'''
+    if df is None:
+        raise LookupError(f"no '{category_name}' category was found for establishment {est}")
+    cache.put(est, category_name, df.to_dict("records"))
+    return df
+
+
+# Takes establishment number as parameter. Calls get on catering options and filters out dirty data. Returns cat ids
+def get_establishment_category_ids(est, resolved=None):
     print(f"\nStarting data processing for establishment: {est}")
     # Getting the initial data from all objects from the endpoint with the category name 'Catering'
-    df_initial_catering = get_category_data(est, "Catering")
+    df_initial_catering = get_cached_category_data(est, "Catering", resolved)
     ''' Using negate ~ on df to evaluate each entry and only populate the new data frame if the 'name' is not equal 
     to either option in the list provided to isin() function. In this case, if the 'name' is 'Catering' or 'Tray Sides',
     we don't want those items. If false, which ~ implies, we keep the item.
@@ -94,37 +279,53 @@ def process_establishment_data(est):
     df_initial_catering = df_initial_catering[~df_initial_catering['name'].isin(['Catering', 'Tray Sides'])]
 
     # Same thing done for the '• Catering' category items (online ordering menu)
-    df_initial_dot_catering = get_category_data(est, "• Catering")
+    df_initial_dot_catering = get_cached_category_data(est, "• Catering", resolved)
     df_initial_dot_catering = df_initial_dot_catering[~df_initial_dot_catering['name'].isin(['Catering', 'Tray Sides'])]
 
     # Once items that we don't want are filtered out, we combine the dataframes with concat, ignoring indexing
     df_combined = pd.concat([df_initial_catering, df_initial_dot_catering], ignore_index=True)
 
-    # Now that we have the items that we want to target, we are going to get their full data
-    filtered_data = []
-    # For each item id in the combined dataframe...
-    for cat_id in df_combined["id"]:
-        # Get the data of the product
-        product_data = get_product_data(est, cat_id)
-        ''' Extend each item to the list created earlier for holding all the data. For each item, we are saying that
-        for each column name in desired column list (all values we need to evaluate or patch the item through the 
-        API endpoint), we are going to get the value of the key.'''
-        filtered_data.extend(
-            [{col: item.get(col, None) for col in DESIRED_COLUMNS} for item in product_data.get("objects", [])]
-        )
+    # Returning the ids of the categories that we want to target
+    return list(df_combined["id"])
 
-    # Once finished, return all the data. We now have everything we need to patch the items in patch_data.py
-    return filtered_data
+
+# Gets the products in a single category and keeps only the columns we need for the condition check and the patch
+def get_product_records(est, cat_id, updated_since=None):
+    # Get the data of the product, every page of it
+    ''' Each item goes straight into the column lists of a ProductRecords, keeping only the columns in desired column
+    list (all values we need to evaluate or patch the item through the API endpoint). The API already only sends
+    these fields back, so this mostly fills in any that are missing from an item with None.'''
+    with tracer.span("get_product_records", "fetch", est=est, category=cat_id):
+        return ProductRecords().append_items(iter_product_data(est, cat_id, updated_since))
+
+
+# Delta version of iter_establishment_data. Yields (est, df) where df is only the items that need to be checked
+def iter_delta_establishment_data(id_list, max_workers=MAX_WORKERS, store=None):
+    ''' Compares each establishment against the local snapshot (snapshot_store.py) as it comes in, so only new or
+    changed items, and items that still needed a patch last run, are passed along. With DELTA_SERVER_FILTER on,
+    establishments that are already in the snapshot only ask the API for products updated since their last fetch.'''
+    store = store or SnapshotStore()
+    fetched_at = snapshot_time()
+    updated_since = {}
+    if DELTA_SERVER_FILTER:
+        updated_since = {est: since for est in id_list if (since := store.updated_since(est)) is not None}
+
+    try:
+        for est, data in iter_establishment_data(id_list, max_workers, updated_since):
+            yield est, store.records_to_check(est, data, fetched_at, full_fetch=est not in updated_since)
+    finally:
+        store.close()
 
 
 # Getting establishment list for GUI
 def get_est_list():
-    url = "https://primohoagies.revelup.com/enterprise/Establishment/"
     # Filtering the data on the GET call to only include 'name' and 'id'
     querystring = {"fields": "name,id"}
 
-    response = requests.request("GET", url, headers=HEADERS, params=querystring)
-    data = response.json()
+    response = api_get("/enterprise/Establishment/", params=querystring)
+    # Raise on an error response, so the GUI keeps its cached list instead of replacing it with an empty one
+    response.raise_for_status()
+    data = decode_json(response)
 
     # Create an empty dictionary to store the data
     est_data = {}
@@ -142,3 +343,4 @@ def get_est_list():
     est_data = dict(sorted(est_data.items()))
 
     return est_data
+
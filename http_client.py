@@ -0,0 +1,218 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+import config
+from config import (HEADERS, MAX_WORKERS, PATCH_WORKERS, CONNECT_TIMEOUT, READ_TIMEOUT, RETRY_ATTEMPTS, RETRY_BACKOFF,
+                    RATE_LIMIT_RETRIES)
+from rate_limiter import limiter
+from tracing import tracer
+
+# orjson decodes a large product page several times faster than the standard json module. It's optional, when it isn't
+# installed responses are decoded with requests' own .json()
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+''' Shared HTTP client for every call made to the Revel API. A single requests.Session keeps connections alive between
+    calls, so the TLS handshake happens once per pooled connection instead of once per request. The connection pool
+    is sized to the fetch and patch worker counts together, since both stages run at once in streaming mode, so every
+    worker thread can hold a connection without waiting on another one. urllib3's pool is thread safe, so the session
+    is shared by all workers.
+
+    Every request also goes through the shared rate limiter (rate_limiter.py), which decides how many requests can be
+    in flight and how fast they go out. A 429 is sent again once the Retry-After time has passed, and a GET that got
+    a server error is sent again after a backoff.'''
+
+# Server errors a GET is sent again on
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# The session is created on first use. The lock keeps two workers from both building one at the same time
+_session = None
+_session_lock = threading.Lock()
+
+# Pool used to fetch the next page of a paginated call while the current page is being processed. Created on first use
+_prefetch_pool = None
+
+
+# Builds the session with the retry policy and a pool that fits the workers
+def _build_session():
+    session = requests.Session()
+    session.headers.update(HEADERS)
+
+    ''' urllib3 only retries a connection that could not be opened at all, meaning the request never reached the
+    server, so it is safe for a PATCH as well. Everything else (5xx, dropped connections, 429) is handed back to
+    _request, which retries it outside of the limiter. Retried in here, the backoff would be slept while holding a
+    limiter slot and the limiter would only ever see the last attempt.'''
+    retry = Retry(
+        total=RETRY_ATTEMPTS,
+        connect=RETRY_ATTEMPTS,
+        read=False,
+        status=0,
+        other=0,
+        backoff_factor=RETRY_BACKOFF,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    pool_size = MAX_WORKERS + PATCH_WORKERS
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Returns the shared session, creating it the first time it is needed
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+# Closes the shared session. The next call will open a fresh one
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# Joins an endpoint path onto the base URL. Read at call time so the base URL can be pointed somewhere else
+def api_url(path):
+    return f"{config.BASE_URL}{path}"
+
+
+# Seconds to wait before sending a failed GET again: RETRY_BACKOFF, then twice that, and so on
+def _backoff(attempt):
+    return RETRY_BACKOFF * (2 ** attempt)
+
+
+# A GET that reached the server but lost its answer (read timeout, dropped connection) is safe to send again. One whose
+# connection couldn't be opened has already been retried by urllib3
+def _retryable_error(exc):
+    if isinstance(exc, requests.ConnectTimeout):
+        return False
+    if isinstance(exc, requests.ReadTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(exc, requests.ConnectionError) and not isinstance(reason, NewConnectionError)
+
+
+''' Sends a request through the rate limiter. A 429 is sent again (up to RATE_LIMIT_RETRIES times), and a GET that got
+a 5xx or lost its connection is sent again after a backoff (up to RETRY_ATTEMPTS times). The limiter sees every
+attempt, and the slot is given back before any wait.'''
+def _request(method, path, **kwargs):
+    attempt = 0
+    failed = 0
+    while True:
+        # Time spent queued behind the rate limiter shows up in the trace as its own span
+        with tracer.span("rate_limiter_wait", "http"):
+            limiter.acquire()
+        start = time.monotonic()
+        # Each request is its own span, named after the endpoint (tracing.py). The limiter tracks latency per endpoint
+        endpoint = tracer.endpoint(method, path)
+        try:
+            with tracer.span(endpoint, "http") as span:
+                response = get_session().request(method, api_url(path), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                                 **kwargs)
+                if span is not None:
+                    span.args["status"] = response.status_code
+        except Exception as exc:
+            limiter.release(time.monotonic() - start, endpoint=endpoint)
+            if method == "GET" and failed < RETRY_ATTEMPTS and _retryable_error(exc):
+                time.sleep(_backoff(failed))
+                failed += 1
+                continue
+            raise
+        limiter.release(time.monotonic() - start, response.status_code, response.headers.get("Retry-After"), endpoint)
+
+        # A 429 means the request was turned away without being processed, so it's safe to send again (even a PATCH)
+        if response.status_code == 429 and attempt < RATE_LIMIT_RETRIES:
+            attempt += 1
+            continue
+        # Only a GET is safe to repeat after a server error
+        if method == "GET" and response.status_code in RETRY_STATUSES and failed < RETRY_ATTEMPTS:
+            time.sleep(_backoff(failed))
+            failed += 1
+            continue
+        return response
+
+
+# GET request against an endpoint path, with the query string passed through params
+def api_get(path, params=None):
+    return _request("GET", path, params=params)
+
+
+# PATCH request against an endpoint path, with the body passed through json
+def api_patch(path, json=None):
+    return _request("PATCH", path, json=json)
+
+
+# Decodes the JSON body of a response, with orjson when it's installed
+def decode_json(response):
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+# Returns the shared prefetch pool, creating it the first time it is needed
+def get_prefetch_pool():
+    global _prefetch_pool
+    with _session_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="prefetch")
+    return _prefetch_pool
+
+
+# Works out the path and query of the page after this one, or None when this is the last page
+def next_page(path, params, meta, page_length):
+    # The API hands back a link to the next page in meta.next, e.g. '/resources/Product/?limit=1000&offset=1000&...'
+    next_link = meta.get("next")
+    if next_link:
+        parts = urlsplit(next_link)
+        return parts.path, dict(parse_qsl(parts.query))
+
+    # Without a link, step the offset forward while total_count says there are more items
+    offset = int(params.get("offset", 0)) + page_length
+    total_count = meta.get("total_count")
+    if page_length and total_count is not None and offset < int(total_count):
+        return path, dict(params, offset=offset)
+    return None
+
+
+# Yields every object of a paginated endpoint, one page at a time. response is the first page, if already requested
+def iter_pages(path, params, response=None):
+    ''' Follows the meta.next link (or the offset) of each page until the last one. As soon as a page comes back the
+    request for the next one is sent on the prefetch pool, so it is on its way while the objects of this page are
+    being handed to the caller. Only one page per call is held in memory at a time, besides the one being fetched.
+
+    The page size is the 'limit' in params. An error response raises requests.HTTPError, so a page that failed can't
+    quietly cut a category short.'''
+    if response is None:
+        response = api_get(path, params)
+    while True:
+        response.raise_for_status()
+        data = decode_json(response)
+        objects = data.get("objects", [])
+
+        # Send the request for the next page before handing over this one
+        future = None
+        following = next_page(path, params, data.get("meta") or {}, len(objects))
+        if following is not None:
+            path, params = following
+            future = get_prefetch_pool().submit(api_get, path, params)
+
+        yield from objects
+
+        if future is None:
+            return
+        response = future.result()
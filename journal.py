@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from config import JOURNAL_FILE, data_path
+
+
+''' Append-only journal of a run, kept in a json lines file in the data folder. Every line is one entry, written (and
+    flushed) as soon as the work it records is done:
+
+        {"entry": "run_started", "establishments": [...], "time": ...}
+        {"entry": "checked", "establishments": [...], "rows": [...]}    rows = items that failed the condition check
+        {"entry": "patched", "id": ..., "status_code": ...}
+        {"entry": "run_finished", "time": ...}
+
+    If the app is closed or the run dies partway, the journal is left without a run_finished line. So is the journal
+    of a run where an establishment failed to fetch or check (see main.end_journal). A resumed run reads it back and
+    skips the work that was already done: establishments that were already fetched and checked are not fetched again,
+    their items that still need a patch are handed straight to the patch stage, and items that were already patched
+    with a 202 are not sent again. The resumed run keeps appending to the same journal, so it
+    can be resumed again if it dies too.
+
+    A line that was only half written when the run died is ignored when the journal is read back.'''
+
+
+# What is left to do from an unfinished run, as read back from the journal
+class ResumeState:
+    def __init__(self, id_list, checked, rows_to_patch):
+        # Every establishment of the original run
+        self.id_list = id_list
+        # Establishments that were already fetched and checked
+        self.checked = checked
+        # Items of the checked establishments that still need a patch (no 202 yet)
+        self.rows_to_patch = rows_to_patch
+
+    # Establishments of the original run that still have to be fetched, in their original order
+    @property
+    def remaining(self):
+        return [est for est in self.id_list if est not in self.checked]
+
+
+class RunJournal:
+    def __init__(self, path=None):
+        self.path = path or data_path(JOURNAL_FILE)
+        # Entries come from the check stage thread as well as the patch loop, so writes go through a lock
+        self.lock = threading.Lock()
+        self.file = None
+
+    # Starts the journal of a new run, throwing away the journal of the last one
+    def start(self, id_list):
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self._write({"entry": "run_started", "establishments": list(id_list), "time": time.time()})
+
+    ''' Reads back the journal of the last run. Returns a ResumeState with what is left to do, or None when there is
+    nothing to resume (no journal, or the last run finished). The journal is then reopened for appending.'''
+    def resume(self):
+        id_list = None
+        checked = set()
+        rows = []
+        patched = set()
+        finished = False
+
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Half written line from the moment the run died
+                        continue
+                    entry = record.get("entry")
+                    if entry == "run_started":
+                        id_list = record["establishments"]
+                    elif entry == "checked":
+                        checked.update(record["establishments"])
+                        rows.extend(record["rows"])
+                    elif entry == "patched" and record["status_code"] == 202:
+                        patched.add(str(record["id"]))
+                    elif entry == "run_finished":
+                        finished = True
+        except OSError:
+            return None
+
+        if id_list is None or finished:
+            return None
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+        # Drop anything that was already patched, along with any item listed twice
+        rows_to_patch = []
+        for row in rows:
+            # Product ids are compared as strings, the same way they go into the patch url
+            product_id = str(row['id'])
+            if product_id not in patched:
+                patched.add(product_id)
+                rows_to_patch.append(row)
+        return ResumeState(id_list, checked, rows_to_patch)
+
+    # Records establishments that have been fetched and checked, with the rows of the items that need a patch
+    def checked(self, establishments, filtered_df):
+        # Plain python values (None for anything missing), so they can be written out as json
+        rows = filtered_df.astype(object).where(filtered_df.notna(), None).to_dict('records')
+        self._write({"entry": "checked", "establishments": list(establishments), "rows": rows})
+
+    # Records the outcome of a single patch
+    def patched(self, product_id, status_code):
+        self._write({"entry": "patched", "id": product_id, "status_code": status_code})
+
+    # Marks the run as finished, so it won't be resumed, and closes the file
+    def finish(self):
+        self._write({"entry": "run_finished", "time": time.time()})
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    # Writes a single line and flushes it, so it is on disk even if the app is closed right after
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.file.flush()
+
@@ -1,7 +1,15 @@
-import pandas as pd
-from condition_check import check_if_item_needs_patch
+from condition_check import items_needing_patch
+from config import STREAMING, DELTA_RUNS, DESIRED_COLUMNS
 from get_data import fetch_data_in_parallel
+from journal import RunJournal
 from patch_data import patch_product_data
+from patch_planner import PatchPlanner, PLAN_COLUMNS
+from pipeline import run_streaming
+from progress import progress
+from rate_limiter import limiter
+from records import records_frame, concat_records
+from result_writers import open_writer, result_file_name
+from tracing import trace_run, tracer
 
 
 ''' This program is designed to go through the catering trays and locate discrepancies between the price of the 
@@ -23,22 +31,102 @@ from patch_data import patch_product_data
     grouped in a separate dataframe, which is then passed along for patching.
     
     All items that are passed to the patch function are split into one of two groups; failed items or passed items. 
-    This function generates two .csv files where the items can be examined after execution.'''
+    This function generates two .csv files where the items can be examined after execution.
+    
+    With STREAMING turned on (config), the same steps run as a pipeline in pipeline.py. Each establishment is checked
+    and patched as soon as its data comes in, and every .csv file is written to as the run goes.
+    
+    With dry_run turned on, the data is fetched and checked as normal but nothing is patched. The patches that would
+    have been sent are written to the patch_plan file instead (patch_planner.py).
+    
+    With delta turned on, each establishment is compared against the snapshot of the last run (snapshot_store.py) and
+    only new or changed items, and items that still needed a patch, are checked. products_data_.csv then only holds
+    those items.
+    
+    Every run that patches keeps a journal of what it has done (journal.py). With resume turned on, data is ignored
+    and the run that was stopped last is picked up where it left off instead: establishments it already checked are
+    not fetched again, and items it already patched with a 202 are not sent again. A run where an establishment failed
+    to fetch or check can be resumed the same way, to try those establishments again.
+    
+    With TRACING turned on (config), every request and step of the run is timed (tracing.py). The trace is written
+    to the data folder and a table of where the time went is printed at the end.'''
+
+@trace_run
+def main(data, streaming=STREAMING, delta=DELTA_RUNS, dry_run=False, resume=False):
+    # A dry run patches nothing, so it has nothing to journal (and leaves the journal of the last real run alone)
+    journal = None if dry_run else RunJournal()
+    resume_rows = []
+    if resume and journal is not None:
+        state = journal.resume()
+        if state is None:
+            print('There is no stopped run to resume, the last run finished.')
+            return
+        data = state.remaining
+        resume_rows = state.rows_to_patch
+        print(f'Resuming the last run: {len(state.checked)} establishments already checked, {len(resume_rows)} items '
+              f'still to patch from them, {len(data)} establishments still to fetch.')
+    elif journal is not None:
+        journal.start(data)
 
-def main(data):
-    # Get the product data for all selected establishments
-    all_product_data = fetch_data_in_parallel(data)
+    # Let anything following the progress of the run know how many establishments are in it
+    progress.emit("run_started", count=len(data))
 
-    # Converts the list of items into a dataframe
-    df_products = pd.DataFrame(all_product_data)
-    # Creating a csv file from the dataframe for logging purposes
-    df_products.to_csv('data_files/products_data_.csv', index=False)
+    # Streaming mode runs the fetch, check and patch stages side by side, one establishment at a time
+    if streaming:
+        checked = run_streaming(data, delta=delta, dry_run=dry_run, journal=journal, resume_rows=resume_rows)
+        print(limiter.summary())
+        if journal is not None:
+            end_journal(journal, data, checked)
+        return
+
+    # Get the product data for all selected establishments, as one dataframe with compact dtypes (records.py)
+    # Each establishment is also written to the products_data_ file for logging purposes, and journaled along with
+    # its items that need a patch, as it comes in
+    fetched = []
+    with open_writer('products_data_', DESIRED_COLUMNS) as writer:
+        df_products = fetch_data_in_parallel(data, delta=delta, writer=writer, fetched=fetched, journal=journal)
 
     # Running the dataframe through our condition check
-    filtered_df = df_products[df_products.apply(check_if_item_needs_patch, axis=1)]
-    # Creating a csv file from this filtered dataframe as well
-    filtered_df.to_csv('data_files/products_data_filtered.csv', index=False)
+    with tracer.span("condition_check", "check", rows=len(df_products)):
+        filtered_df = df_products[items_needing_patch(df_products)]
+    # Every establishment that came back has been checked in this one pass
+    snapshot = progress.snapshot()
+    progress.emit("items_checked", count=len(df_products),
+                  establishments=snapshot["establishments_done"] - snapshot["establishments_failed"])
+    # Items left over from the run being resumed are patched along with everything found this time
+    if resume_rows:
+        filtered_df = concat_records([records_frame(resume_rows), filtered_df])
+
+    # Writing this filtered dataframe out as well
+    with open_writer('products_data_filtered', DESIRED_COLUMNS) as writer:
+        writer.write_frame(filtered_df)
+
+    # Dropping repeated ids and no-op changes, and building the body of every patch (patch_planner.py)
+    planner = PatchPlanner()
+    plan = planner.plan(filtered_df)
+    progress.emit("patches_queued", count=len(plan))
+    print(f'\n{planner.summary()}')
+
+    # A dry run stops here, with the patches that would be sent in patch_plan
+    if dry_run:
+        with open_writer('patch_plan', PLAN_COLUMNS) as writer:
+            writer.write_frame(plan.report_frame())
+        print(f'\nDry run: {len(plan)} items would be patched. See the {result_file_name("patch_plan")} file.')
+        return
 
     # Updates the items that failed the condition check
     print('\nPatching items:')
-    patch_product_data(filtered_df)
+    patch_product_data(plan, journal=journal)
+    end_journal(journal, data, fetched)
+    print(limiter.summary())
+
+
+# Closes the journal at the end of a run. Unless every establishment made it through the check, the run is left open
+# so a resumed run fetches the ones that failed again
+def end_journal(journal, id_list, checked):
+    missed = len(set(id_list) - set(checked))
+    if missed:
+        journal.close()
+        print(f'{missed} establishments failed to fetch or check. Resume the run to try them again.')
+    else:
+        journal.finish()
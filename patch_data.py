@@ -1,76 +1,137 @@
 import pandas as pd
 import requests
-from config import HEADERS
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import PATCH_WORKERS
+from http_client import api_patch
+from patch_planner import PatchPlanner, full_payload
+from progress import progress
+from result_writers import open_writer, result_file_name
+from tracing import tracer
 
 
-# Takes the full dataset that we filtered for condition check after populating from process_establishment_data func
-def patch_product_data(filtered_df):
-    # Creating lists and counter for failed items and passed items
+# Columns of the failed_items and passed_items files
+FAILED_COLUMNS = ['product_id', 'name', 'establishment', 'category', 'status_code', 'response_text']
+PASSED_COLUMNS = ['product_id', 'name', 'establishment', 'status_code', 'response_text']
+
+
+# Patches a single item. Runs inside a pool worker, returns whether it passed along with the details for the csv files
+def patch_single_product(row):
+    # Get the product id that will be appended to the URL
+    product_id = str(row['id'])
+    # The body comes from the patch plan (patch_planner.py) when there is one, otherwise the full body is built here
+    payload = row.get('payload') or full_payload(row)
+    # Passing product id to the endpoint and the json data on the patch request
+    try:
+        with tracer.span("patch_single_product", "patch", id=product_id, establishment=row['establishment']):
+            response = api_patch(f'/resources/Product/{product_id}/', json=payload)
+            # If the API won't take a minimal body, send the full one instead
+            if response.status_code == 400 and 'name' not in payload:
+                response = api_patch(f'/resources/Product/{product_id}/', json=full_payload(row))
+    except requests.RequestException as exc:
+        # A timeout or dropped connection on one item goes in the failed items, the rest of the run carries on
+        print(f'Failed to update product {row["name"]} with ID {product_id}: {exc}')
+        progress.emit("item_patched", passed=False)
+        return False, {
+            'product_id': product_id,
+            'name': row['name'],
+            'establishment': row['establishment'],
+            'category': row['category'],
+            'status_code': None,
+            'response_text': str(exc)
+        }
+
+    # Printing updates on each item as they are patched
+    print(f'Updated product {row["name"]} with ID {product_id}, Status Code: {response.status_code}')
+    progress.emit("item_patched", passed=response.status_code == 202)
+
+    # Check the status code of the response. 202 would be successful
+    if response.status_code != 202:
+        # Save the details of the non-202 response
+        return False, {
+            'product_id': product_id,
+            'name': row['name'],
+            'establishment': row['establishment'],
+            'category': row['category'],
+            'status_code': response.status_code,
+            'response_text': response.text
+        }
+
+    # Save the details of the 202 response
+    return True, {
+        'product_id': product_id,
+        'name': row['name'],
+        'establishment': row['establishment'],
+        'status_code': response.status_code,
+        'response_text': response.text
+    }
+
+
+# Takes the full dataset that we filtered for condition check after populating from fetch_data_in_parallel
+def patch_product_data(plan, max_workers=PATCH_WORKERS, journal=None):
+    # Creating lists for failed items and passed items
     non_202_data = []
     success_202_data = []
-    failed_count = 0
-    passed_count = 0
-
-    # Iterate over each row in the filtered dataframe
-    for index, row in filtered_df.iterrows():
-        # Get the product id that will be appended to the URL
-        product_id = str(row['id'])
-        # Prepare the data for the item that is going to be patched, passed in json through patch request
-        data = {
-            "name": row['name'],
-            "price": float(row['price']),
-            "establishment": row['establishment'],
-            "updated_by": row['updated_by'],
-            "created_by": row['created_by'],
-            "category": row['category'],
-            "attribute_type": int(row['attribute_type']),
-            "tax_class": int(row['tax_class']),
-            "variable_pricing_by": int(row['variable_pricing_by']),
-            "sorting": int(row['sorting']),
-            "combo_upcharge": str(float(row['price']))
-        }
-        # Passing product id to the endpoint
-        url = f'https://primohoagies.revelup.com/resources/Product/{product_id}/'
-        # Passing the json data on the patch request
-        response = requests.patch(url, headers=HEADERS, json=data)
-
-        # Check the status code of the response. 202 would be successful
-        if response.status_code != 202:
-            # Increment the failed variable
-            failed_count += 1
-            # Save the details of the non-202 response to the list
-            non_202_data.append({
-                'product_id': product_id,
-                'name': row['name'],
-                'establishment': row['establishment'],
-                'category': row['category'],
-                'status_code': response.status_code,
-                'response_text': response.text
-            })
-
-        else:
-            # Increment the total of passed items
-            passed_count += 1
-            # Save the details of the 202 response to the list
-            success_202_data.append({
-                'product_id': product_id,
-                'name': row['name'],
-                'establishment': row['establishment'],
-                'status_code': response.status_code,
-                'response_text': response.text
-            })
-
-        # Printing updates on each item as they are patched
-        print(f'Updated product {row["name"]} with ID {product_id}, Status Code: {response.status_code}')
 
-    # Convert the list of dictionaries to a DataFrame
-    df_non_202_responses = pd.DataFrame(non_202_data)
-    df_202_responses = pd.DataFrame(success_202_data)
+    # plan is a PatchPlan from patch_planner.py. A dataframe straight from the condition check is planned here first
+    if not hasattr(plan, 'rows'):
+        plan = PatchPlanner().plan(plan)
+    # Plain dicts are much cheaper to hand to the workers than the Series objects iterrows() builds for every row
+    rows = plan.rows
+
+    # The passed and failed items are written out as they come back, so a run that is stopped keeps what it patched
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open_writer('failed_items', FAILED_COLUMNS) as failed_writer, \
+            open_writer('passed_items', PASSED_COLUMNS) as passed_writer:
+        for passed, result in iter_patch_results(executor, rows, max_workers, journal):
+            # Sort each result into the passed or failed list
+            if passed:
+                success_202_data.append(result)
+                passed_writer.write_row(result)
+            else:
+                non_202_data.append(result)
+                failed_writer.write_row(result)
 
-    # Saving the passed and failed items to a csv file
-    df_non_202_responses.to_csv('data_files/failed_items.csv', index=False)
-    df_202_responses.to_csv('data_files/passed_items.csv', index=False)
+    # Convert the list of dictionaries to a DataFrame
+    df_non_202_responses = pd.DataFrame(non_202_data, columns=FAILED_COLUMNS)
+    df_202_responses = pd.DataFrame(success_202_data, columns=PASSED_COLUMNS)
 
     # Print the number of failed items and the number of passed items
-    print(failed_count, 'items failed to update. See the failed_items.csv for more information.')
-    print(passed_count, 'items were patched successfully. See the passed_items.csv file for more information')
+    print(len(non_202_data), f'items failed to update. See the {result_file_name("failed_items")} for more '
+                             f'information.')
+    print(len(success_202_data), f'items were patched successfully. See the {result_file_name("passed_items")} file '
+                                 f'for more information')
+
+    # Returning the failed and passed items so callers can inspect the split without reading the files back in
+    return df_non_202_responses, df_202_responses
+
+
+# Sends the patch for every row on the executor and yields (passed, result) for each row, in the same order as the rows
+def iter_patch_results(executor, rows, max_workers=PATCH_WORKERS, journal=None):
+    ''' Several requests are in flight at once, but results are handed back in the same order the rows went in, no
+    matter which request finishes first, so the csv files come out in the same order on every run. Only a few
+    patches per worker are submitted ahead of the one being waited on, so a long (or never ending) stream of rows is
+    never all sitting in the executor at the same time.
+
+    When a run journal is passed, each outcome is recorded in it the moment its request finishes rather than when it
+    is handed back. If the run dies while waiting on one patch, the ones that finished after it are still on record.'''
+    in_flight = deque()
+    for row in rows:
+        future = executor.submit(patch_single_product, row)
+        if journal is not None:
+            future.add_done_callback(lambda done: _journal_result(journal, done))
+        in_flight.append(future)
+        # Once the window is full, wait on the oldest request before sending another one
+        if len(in_flight) >= max_workers * 4:
+            yield in_flight.popleft().result()
+
+    # Hand back whatever is left once every row has been sent
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+# Records a finished patch in the run journal. Patches that raised were never confirmed, so they are left off
+def _journal_result(journal, future):
+    if future.exception() is None:
+        passed, result = future.result()
+        journal.patched(result['product_id'], result['status_code'])
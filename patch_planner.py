@@ -0,0 +1,130 @@
+import json
+import pandas as pd
+from condition_check import items_needing_patch
+from config import PRICE_TOLERANCE, PATCH_MINIMAL_PAYLOAD
+
+
+''' Planning step between the condition check and the patch. It takes the items that failed the condition check and
+    works out exactly what will be sent:
+
+    - Each product id is patched once. An item can show up under both the 'Catering' and '• Catering' subcategory
+      lists, and the planner remembers every id it has planned during the run, so a repeat is dropped even when it
+      comes from a later establishment.
+    - Items whose price and combo_upcharge are already within PRICE_TOLERANCE (the same tolerance as the condition
+      check) are dropped as no-op changes. This matters for items coming back from a resumed run's journal.
+    - The json body of every patch is built for the whole batch at once, column by column, instead of one row at a
+      time in the patch workers.
+
+    With PATCH_MINIMAL_PAYLOAD on, the body only carries combo_upcharge, the one field being changed. If the API turns
+    a minimal body down with a 400, patch_data.py sends that item again with the full body. Turned off, every patch
+    sends the full body the app has always sent.
+
+    Minimal bodies are off by default. The Revel API documentation lists every field of the full body as required
+    (see DESIRED_COLUMNS in config.py), and if the API does turn one-field bodies down, every patch would be sent
+    twice. Turn them on once they have been checked against the real API.
+
+    On a dry run the plan is written out (see PLAN_COLUMNS) so it can be looked over before anything is sent.'''
+
+# Fields of the full patch body, in the order they have always been sent
+FULL_PAYLOAD_FIELDS = ['name', 'price', 'establishment', 'updated_by', 'created_by', 'category', 'attribute_type',
+                       'tax_class', 'variable_pricing_by', 'sorting', 'combo_upcharge']
+
+# Columns of the patch_plan file written on a dry run
+PLAN_COLUMNS = ['product_id', 'name', 'establishment', 'category', 'price', 'combo_upcharge', 'new_combo_upcharge',
+                'payload']
+
+
+# The items of one planning call, each a dict of the row with its json body under 'payload'
+class PatchPlan:
+    def __init__(self, frame, rows):
+        # The planned items as a dataframe, and the same items as the row dicts that are handed to the patch workers
+        self.frame = frame
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    # The plan in the PLAN_COLUMNS layout, for the dry run report
+    def report_frame(self):
+        frame = self.frame
+        return pd.DataFrame({
+            'product_id': frame['id'],
+            'name': frame['name'],
+            'establishment': frame['establishment'],
+            'category': frame['category'],
+            'price': frame['price'],
+            'combo_upcharge': frame['combo_upcharge'],
+            'new_combo_upcharge': [row['payload']['combo_upcharge'] for row in self.rows],
+            'payload': [json.dumps(row['payload']) for row in self.rows],
+        }, columns=PLAN_COLUMNS)
+
+
+class PatchPlanner:
+    def __init__(self, tolerance=PRICE_TOLERANCE, minimal=PATCH_MINIMAL_PAYLOAD):
+        self.tolerance = tolerance
+        self.minimal = minimal
+        # Every product id planned so far in this run
+        self.seen = set()
+        # Counters for the summary line
+        self.items_in = 0
+        self.duplicates = 0
+        self.no_ops = 0
+        self.planned = 0
+
+    # Plans the patches for a dataframe of items that failed the condition check
+    def plan(self, df):
+        self.items_in += len(df)
+        if df.empty:
+            return PatchPlan(df, [])
+
+        ids = df['id']
+        duplicate = ids.duplicated(keep='first') | ids.isin(self.seen)
+        no_op = ~items_needing_patch(df, self.tolerance)
+        planned = df[~duplicate & ~no_op]
+
+        self.duplicates += int(duplicate.sum())
+        self.no_ops += int((no_op & ~duplicate).sum())
+        self.planned += len(planned)
+        self.seen.update(planned['id'].tolist())
+
+        rows = planned.to_dict('records')
+        for row, payload in zip(rows, build_payloads(planned, self.minimal)):
+            row['payload'] = payload
+        return PatchPlan(planned, rows)
+
+    # One line with what the planner did over the run
+    def summary(self):
+        fields = 1 if self.minimal else len(FULL_PAYLOAD_FIELDS)
+        return (f"Patch plan: {self.items_in} items checked in, {self.duplicates} duplicate ids and {self.no_ops} "
+                f"no-op changes dropped, {self.planned} to patch with a {fields} field body")
+
+
+# Builds the json body of every row of the dataframe in one pass over its columns
+def build_payloads(df, minimal=PATCH_MINIMAL_PAYLOAD):
+    price = pd.to_numeric(df['price'], errors='coerce').astype('float64')
+    # The upcharge is sent as the string of the price, e.g. "12.99"
+    combo_upcharge = price.astype(str)
+    if minimal:
+        return [{"combo_upcharge": value} for value in combo_upcharge.tolist()]
+
+    ''' The full body, with the price as a float and the numeric fields as ints. Anything missing goes out as null,
+    instead of failing the whole batch on one item.'''
+    payloads = pd.DataFrame({
+        'name': df['name'].astype(object),
+        'price': price,
+        'establishment': df['establishment'].astype(object),
+        'updated_by': df['updated_by'].astype(object),
+        'created_by': df['created_by'].astype(object),
+        'category': df['category'].astype(object),
+        'attribute_type': pd.to_numeric(df['attribute_type'], errors='coerce').astype('Int64'),
+        'tax_class': pd.to_numeric(df['tax_class'], errors='coerce').astype('Int64'),
+        'variable_pricing_by': pd.to_numeric(df['variable_pricing_by'], errors='coerce').astype('Int64'),
+        'sorting': pd.to_numeric(df['sorting'], errors='coerce').astype('Int64'),
+        'combo_upcharge': combo_upcharge,
+    }, columns=FULL_PAYLOAD_FIELDS)
+    return payloads.astype(object).where(payloads.notna(), None).to_dict('records')
+
+
+# Full body of a single row, e.g. to send again when the API turns down a minimal body
+def full_payload(row):
+    return build_payloads(pd.DataFrame([row]), minimal=False)[0]
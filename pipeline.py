@@ -0,0 +1,164 @@
+import queue
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from condition_check import items_needing_patch
+from config import DESIRED_COLUMNS, PATCH_WORKERS, STREAM_QUEUE_SIZE
+from get_data import iter_establishment_data, iter_delta_establishment_data
+from patch_data import FAILED_COLUMNS, PASSED_COLUMNS, iter_patch_results
+from patch_planner import PatchPlanner, PLAN_COLUMNS
+from progress import progress
+from records import records_frame
+from result_writers import open_writer, result_file_name
+from tracing import tracer
+
+
+''' Streaming version of main.main. Instead of downloading the whole fleet into one dataframe before anything else
+    happens, the run is split into three stages that each work on one establishment at a time:
+
+    fetch -> (queue) -> condition check -> (queue) -> patch
+
+    The fetch stage hands each establishment over as soon as all of its products are in. The check stage writes the
+    rows to products_data_, runs the condition check and writes the items that need a patch to
+    products_data_filtered, then plans their patches (patch_planner.py). One planner is used for the whole run, so a
+    product id is only patched once even across establishments. The patch stage sends those patches and writes each
+    result to passed_items or failed_items as it comes back. The files are written through result_writers.py (csv
+    unless RESULT_FORMAT says otherwise). The queues between the stages only hold a few establishments, so a slow
+    stage holds up the one before it instead of letting data pile up in memory.
+
+    When a run journal is passed (journal.py), each checked establishment and each patch result is recorded in it as
+    it happens. resume_rows are the items a resumed run still has to patch from establishments that were checked
+    before it was stopped. They go to the patch stage first, ahead of anything fetched in this run.'''
+
+# Placed on a queue to let the next stage know nothing else is coming
+_DONE = object()
+
+
+# Runs the fetch, check and patch stages at the same time for the list of establishment ids
+def run_streaming(id_list, queue_size=STREAM_QUEUE_SIZE, patch_workers=PATCH_WORKERS, delta=False, dry_run=False,
+                  journal=None, resume_rows=None):
+    # Establishments that have been fetched and are waiting on the condition check
+    fetched = queue.Queue(maxsize=queue_size)
+    # Planned rows (as dicts) of each establishment that failed the condition check and are waiting to be patched
+    to_patch = queue.Queue(maxsize=queue_size)
+    planner = PatchPlanner()
+    # Establishments that made it through the check stage, handed back so the caller can tell if any were missed
+    checked = []
+    # Set when the check stage fails as a whole, so the fetch stage stops. The error is raised again in the caller
+    stop = threading.Event()
+    errors = []
+
+    ''' FETCH STAGE '''
+    def fetch_stage():
+        try:
+            # put() blocks while the queue is full, which holds the fetch back until the check stage catches up
+            establishments = iter_delta_establishment_data(id_list) if delta else iter_establishment_data(id_list)
+            for est, data in establishments:
+                if stop.is_set():
+                    break
+                fetched.put((est, data))
+        except Exception as exc:
+            print(f"\nFetching stopped early: {exc}")
+        finally:
+            fetched.put(_DONE)
+
+    ''' CONDITION CHECK STAGE '''
+    def check_stage():
+        try:
+            # A dry run writes out the plan instead of sending it
+            with open_writer('products_data_', DESIRED_COLUMNS) as products_writer, \
+                    open_writer('products_data_filtered', DESIRED_COLUMNS) as filtered_writer, \
+                    (open_writer('patch_plan', PLAN_COLUMNS) if dry_run else nullcontext()) as plan_writer:
+
+                # Plans the patches of a batch of items and hands them over to the patch stage
+                def queue_patches(filtered_df):
+                    plan = planner.plan(filtered_df)
+                    progress.emit("patches_queued", count=len(plan))
+                    if plan_writer is not None:
+                        plan_writer.write_frame(plan.report_frame())
+                    to_patch.put(plan.rows)
+
+                # Items left over from the run being resumed are logged and patched first
+                if resume_rows:
+                    resume_df = records_frame(resume_rows)
+                    filtered_writer.write_frame(resume_df)
+                    queue_patches(resume_df)
+
+                while (item := fetched.get()) is not _DONE:
+                    est, df_products = item
+                    try:
+                        # Logs the items of this establishment to the results
+                        products_writer.write_frame(df_products)
+
+                        # Running the dataframe through our condition check and logging what needs a patch
+                        with tracer.span("condition_check", "check", est=est, rows=len(df_products)):
+                            filtered_df = df_products[items_needing_patch(df_products)]
+                        filtered_writer.write_frame(filtered_df)
+                        progress.emit("items_checked", count=len(df_products))
+                        if journal is not None:
+                            journal.checked([est], filtered_df)
+
+                        # Hand the items over to the patch stage
+                        queue_patches(filtered_df)
+                        checked.append(est)
+                    except Exception as exc:
+                        print(f"\nEstablishment {est} could not be checked: {exc}")
+        except Exception as exc:
+            ''' Anything outside a single establishment (a result file that can't be opened, the resumed items) stops
+            the run. The fetch stage is told to stop and the queue is emptied until it does, so it can't be left stuck
+            on a full queue.'''
+            errors.append(exc)
+            stop.set()
+            while fetched.get() is not _DONE:
+                pass
+        finally:
+            to_patch.put(_DONE)
+
+    # Yields the rows to patch one at a time, as each establishment comes out of the check stage
+    def rows_to_patch():
+        while (batch := to_patch.get()) is not _DONE:
+            yield from batch
+
+    # Daemon threads, so a stage stuck on a full queue can never keep the app open
+    threads = [threading.Thread(target=fetch_stage, daemon=True), threading.Thread(target=check_stage, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    # A dry run only counts what would have been patched, the patches are in patch_plan
+    if dry_run:
+        would_patch = sum(1 for _ in rows_to_patch())
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        print(f'\n{planner.summary()}')
+        print(f'\nDry run: {would_patch} items would be patched. See the {result_file_name("patch_plan")} file.')
+        return checked
+
+    ''' PATCH STAGE '''
+    print('\nPatching items:')
+    failed_count = 0
+    passed_count = 0
+    with open_writer('failed_items', FAILED_COLUMNS) as failed_writer, \
+            open_writer('passed_items', PASSED_COLUMNS) as passed_writer, \
+            ThreadPoolExecutor(max_workers=patch_workers) as executor:
+        for passed, result in iter_patch_results(executor, rows_to_patch(), patch_workers, journal):
+            # Each result goes straight into its file, so nothing is lost if the run is stopped partway
+            if passed:
+                passed_count += 1
+                passed_writer.write_row(result)
+            else:
+                failed_count += 1
+                failed_writer.write_row(result)
+
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    print(f'\n{planner.summary()}')
+
+    # Print the number of failed items and the number of passed items
+    print(failed_count, f'items failed to update. See the {result_file_name("failed_items")} for more information.')
+    print(passed_count, f'items were patched successfully. See the {result_file_name("passed_items")} file for more '
+                        f'information')
+    return checked
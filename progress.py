@@ -0,0 +1,165 @@
+import threading
+import time
+
+
+''' Progress events for a run. The fetch, check and patch stages call progress.emit() as work is queued and finished,
+    and anything that wants to follow along (the GUI progress bar, the console reporter of a headless run) subscribes
+    a callback. Every callback is handed the event name and a snapshot of the counters.
+
+    Events:
+        run_started         count = number of establishments selected
+        requests_queued     count = product calls queued for an establishment once its categories are known
+        requests_dropped    count = queued product calls that won't be made (their establishment failed)
+        request_done        a product call came back
+        establishment_done  failed = True when the establishment raised an exception
+        items_checked       count = items run through the condition check, establishments = how many they came from
+        patches_queued      count = items that failed the condition check and will be patched
+        item_patched        passed = True on a 202
+
+    The work of a run is counted as product calls plus patches. Until every establishment has had its categories
+    resolved and been checked, the totals are estimated from the establishments seen so far, so the fraction and ETA
+    firm up as the run goes.'''
+
+
+class ProgressTracker:
+    def __init__(self):
+        # emit() is called from every worker thread, so the counters and subscriber list sit behind a lock
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.reset()
+
+    # Clears all counters
+    def reset(self, establishments_total=0):
+        with self.lock:
+            self._reset_counters(establishments_total)
+
+    def _reset_counters(self, establishments_total):
+        self.started = time.monotonic()
+        self.establishments_total = establishments_total
+        self.establishments_resolved = 0
+        self.establishments_done = 0
+        self.establishments_failed = 0
+        self.establishments_checked = 0
+        self.requests_total = 0
+        self.requests_done = 0
+        self.items_checked = 0
+        self.patches_total = 0
+        self.items_patched = 0
+        self.patches_failed = 0
+
+    # Adds a callback that is called as callback(event, snapshot) on every event, from whichever thread emitted it
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    # Records an event and passes it on to every subscriber
+    def emit(self, event, count=1, passed=True, failed=False, establishments=1):
+        with self.lock:
+            if event == "run_started":
+                self._reset_counters(count)
+            elif event == "requests_queued":
+                self.establishments_resolved += 1
+                self.requests_total += count
+            elif event == "requests_dropped":
+                self.requests_total -= count
+            elif event == "request_done":
+                self.requests_done += count
+            elif event == "establishment_done":
+                self.establishments_done += 1
+                if failed:
+                    self.establishments_failed += 1
+            elif event == "items_checked":
+                self.establishments_checked += establishments
+                self.items_checked += count
+            elif event == "patches_queued":
+                self.patches_total += count
+            elif event == "item_patched":
+                self.items_patched += count
+                if not passed:
+                    self.patches_failed += count
+            snapshot = self._snapshot()
+            subscribers = list(self.subscribers)
+
+        # Callbacks run outside the lock, so a slow subscriber can't hold up the other workers' emits
+        for callback in subscribers:
+            callback(event, snapshot)
+
+    # Current counters along with the rate, estimated fraction done and ETA
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        elapsed = time.monotonic() - self.started
+
+        # Product calls for establishments that haven't had their categories resolved yet, estimated from the average
+        requests_expected = self.requests_total
+        unresolved = max(self.establishments_total - self.establishments_resolved - self.establishments_failed, 0)
+        if self.establishments_resolved:
+            requests_expected += unresolved * self.requests_total / self.establishments_resolved
+
+        # Patches for establishments that haven't been checked yet, estimated the same way
+        patches_expected = self.patches_total
+        unchecked = max(self.establishments_total - self.establishments_checked - self.establishments_failed, 0)
+        if self.establishments_checked:
+            patches_expected += unchecked * self.patches_total / self.establishments_checked
+
+        work_done = self.requests_done + self.items_patched
+        work_expected = requests_expected + patches_expected
+        # Nothing is known about the size of the run until the first establishment is resolved
+        fraction = min(work_done / work_expected, 1.0) if work_expected else 0.0
+
+        rate = work_done / elapsed if elapsed > 0 else 0.0
+        eta = (work_expected - work_done) / rate if rate and work_expected else None
+
+        return {
+            "elapsed": elapsed,
+            "establishments_total": self.establishments_total,
+            "establishments_done": self.establishments_done,
+            "establishments_failed": self.establishments_failed,
+            "requests_total": self.requests_total,
+            "requests_done": self.requests_done,
+            "items_checked": self.items_checked,
+            "patches_total": self.patches_total,
+            "items_patched": self.items_patched,
+            "patches_failed": self.patches_failed,
+            "requests_per_sec": rate,
+            "fraction": fraction,
+            "eta": eta,
+        }
+
+
+# Formats a snapshot as a single status line, used by the GUI label and the console reporter
+def format_progress(snapshot):
+    eta = snapshot["eta"]
+    eta_text = "--" if eta is None else f"{int(eta // 60)}m {int(eta % 60):02d}s"
+    return (f"Est {snapshot['establishments_done']}/{snapshot['establishments_total']} | "
+            f"Requests {snapshot['requests_done']}/{snapshot['requests_total']} | "
+            f"Checked {snapshot['items_checked']} | "
+            f"Patched {snapshot['items_patched']}/{snapshot['patches_total']} | "
+            f"{snapshot['requests_per_sec']:.1f} req/s | ETA {eta_text}")
+
+
+# Subscriber for headless runs. Prints a status line at most once every interval seconds
+class ConsoleProgressReporter:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.last_print = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, event, snapshot):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_print < self.interval:
+                return
+            self.last_print = now
+        print(format_progress(snapshot))
+
+
+# Shared tracker that every stage reports to
+progress = ProgressTracker()
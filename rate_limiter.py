@@ -0,0 +1,148 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import (RATE_LIMIT_PER_SEC, MAX_RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST, MIN_CONCURRENCY, MAX_CONCURRENCY,
+                    INITIAL_CONCURRENCY, LATENCY_SPIKE_FACTOR)
+
+
+''' One request budget shared by every call to the Revel API, fetch and patch alike (see http_client.py). It combines
+    two limits:
+
+    - A token bucket that caps the request rate. Tokens refill at the current rate, up to RATE_LIMIT_BURST. The rate
+      starts at RATE_LIMIT_PER_SEC and goes up a little with every healthy response, up to MAX_RATE_LIMIT_PER_SEC.
+    - An adaptive limit on how many requests are in flight at once, using AIMD (additive increase, multiplicative
+      decrease). Each time a full window of requests comes back healthy, the limit goes up by one. A 429, a 5xx,
+      a connection error or a latency spike cuts it in half.
+
+    A latency spike is a response slower than LATENCY_SPIKE_FACTOR times the usual latency of its endpoint. A page of
+    products naturally takes several times longer than a PATCH, so each endpoint (named the way tracing.py names
+    them, e.g. 'PATCH /resources/Product/{id}/') keeps its own smoothed average to be compared against.
+
+    A 429 also halves the token rate and pauses all requests for the Retry-After time the server asked for. The rate
+    then climbs back up as requests succeed again. Decreases happen at most once per latency window of the endpoint,
+    so one burst of errors from requests that were all sent together only counts once.'''
+
+# Weight of the newest response in an endpoint's average latency
+BASELINE_SMOOTHING = 0.1
+
+
+class AdaptiveLimiter:
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, max_rate=MAX_RATE_LIMIT_PER_SEC, burst=RATE_LIMIT_BURST,
+                 min_concurrency=MIN_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 initial_concurrency=INITIAL_CONCURRENCY, latency_spike_factor=LATENCY_SPIKE_FACTOR):
+        self.max_rate = max_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = initial_concurrency
+        self.latency_spike_factor = latency_spike_factor
+
+        self.in_flight = 0
+        self.successes = 0
+        # Smoothed latency of the healthy responses of each endpoint
+        self.baselines = {}
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.errors = 0
+
+        # Workers wait on the condition until both a slot and a token are free
+        self.condition = threading.Condition()
+
+    # Adds the tokens earned since the last refill. Called with the condition held
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # Blocks until the request is allowed to go out
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    # The server asked us to back off (Retry-After)
+                    wait = self.paused_until - now
+                elif self.in_flight >= self.limit:
+                    # Every slot is taken, wait for a request to come back
+                    wait = None
+                elif self.tokens < 1:
+                    # Wait for the next token
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self.condition.wait(wait)
+
+    ''' Called once the request is finished. status_code is None when the request raised (timeout, connection error).
+    retry_after is the Retry-After header of the response, if it had one. endpoint groups the request with others of
+    the same kind for the latency check.'''
+    def release(self, latency, status_code=None, retry_after=None, endpoint=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            baseline = self.baselines.get(endpoint)
+
+            if status_code == 429:
+                self.throttled += 1
+                self.paused_until = max(self.paused_until, now + parse_retry_after(retry_after))
+                self._decrease(now, baseline, slow_down=True)
+            elif status_code is None or status_code >= 500:
+                self.errors += 1
+                self._decrease(now, baseline)
+            else:
+                # The first response of an endpoint sets its baseline, every response after that moves it a little
+                if baseline is None:
+                    self.baselines[endpoint] = latency
+                else:
+                    self.baselines[endpoint] = baseline + (latency - baseline) * BASELINE_SMOOTHING
+
+                if baseline is not None and latency > baseline * self.latency_spike_factor and latency > 0.05:
+                    self._decrease(now, baseline)
+                else:
+                    # Additive increase: one more slot for every full window of healthy requests
+                    self.successes += 1
+                    if self.successes >= self.limit:
+                        self.successes = 0
+                        self.limit = min(self.limit + 1, self.max_concurrency)
+                    self.rate = min(self.rate + 1, self.max_rate)
+
+            self.condition.notify_all()
+
+    # Multiplicative decrease, at most once per latency window (baseline). slow_down halves the token rate as well
+    def _decrease(self, now, baseline=None, slow_down=False):
+        if now - self.last_decrease < (baseline or 0.1):
+            return
+        self.last_decrease = now
+        self.successes = 0
+        self.limit = max(self.min_concurrency, self.limit // 2)
+        if slow_down:
+            self.rate = max(self.rate / 2, 1.0)
+
+    # One line with the state of the limiter, for the end of a run
+    def summary(self):
+        with self.condition:
+            return (f"Rate limiter: concurrency limit {self.limit}, {self.rate:.0f} req/s cap, "
+                    f"{self.throttled} throttled (429), {self.errors} errors")
+
+
+# Seconds to wait from a Retry-After header, which can be a number of seconds or a date. One second if it's missing
+def parse_retry_after(value):
+    if not value:
+        return 1.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+# Shared limiter that every request goes through
+limiter = AdaptiveLimiter()
@@ -0,0 +1,88 @@
+import sys
+import pandas as pd
+from pandas.api.types import union_categoricals
+from config import DESIRED_COLUMNS
+
+
+''' Compact, column by column format for the product data. Items coming back from the API are appended straight into
+    one list per column (no dict per product), and each establishment is turned into a dataframe with real dtypes as
+    soon as it is complete:
+
+    - id is an integer, price and combo_upcharge are floats, and the small setting columns are 32 bit integers.
+      Values that can't be read as a number become NaN/<NA>, which the condition check treats as "not patched".
+    - The hyperlink columns (establishment, category, created_by, updated_by) and the item name repeat across hundreds
+      of thousands of rows, so they are categoricals. Each distinct string is stored once and every row holds a small
+      integer code instead.
+
+    Strings are interned while appending, so the per column lists of an establishment share one copy of each value
+    before they are converted.'''
+
+# Columns converted to numbers, with the dtype they are stored as
+NUMERIC_DTYPES = {
+    'id': 'Int64',
+    'price': 'float64',
+    'combo_upcharge': 'float64',
+    'attribute_type': 'Int32',
+    'sorting': 'Int32',
+    'variable_pricing_by': 'Int32',
+    'tax_class': 'Int32',
+}
+
+# Columns stored as categoricals
+CATEGORICAL_COLUMNS = ['establishment', 'name', 'category', 'updated_by', 'created_by']
+
+
+# Builds up the product data of one or more product calls, one list per column
+class ProductRecords:
+    def __init__(self):
+        self.columns = {col: [] for col in DESIRED_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns[DESIRED_COLUMNS[0]])
+
+    # Appends API items (or any dicts), keeping only DESIRED_COLUMNS. Missing keys are stored as None
+    def append_items(self, items):
+        intern = sys.intern
+        for item in items:
+            for col, values in self.columns.items():
+                value = item.get(col)
+                values.append(intern(value) if type(value) is str else value)
+        return self
+
+    # Adds the columns of another ProductRecords onto the end of this one
+    def extend(self, other):
+        for col, values in self.columns.items():
+            values.extend(other.columns[col])
+        return self
+
+    # Converts the columns into a dataframe with compact dtypes
+    def to_frame(self):
+        data = {}
+        for col, values in self.columns.items():
+            if col in NUMERIC_DTYPES:
+                data[col] = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').astype(NUMERIC_DTYPES[col])
+            else:
+                data[col] = pd.Series(values, dtype='category')
+        return pd.DataFrame(data, columns=DESIRED_COLUMNS)
+
+
+# Builds a compact dataframe from a list of dicts (API items or rows read back from a file)
+def records_frame(items):
+    return ProductRecords().append_items(items).to_frame()
+
+
+# Joins the dataframes of several establishments, keeping the categorical columns as categoricals
+def concat_records(frames):
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return ProductRecords().to_frame()
+
+    ''' pd.concat turns categoricals with different categories back into plain object columns, which is the whole
+    cost we are trying to avoid. union_categoricals merges the categories of each column instead.'''
+    data = {}
+    for col in DESIRED_COLUMNS:
+        if col in CATEGORICAL_COLUMNS:
+            data[col] = pd.Series(union_categoricals([frame[col] for frame in frames]))
+        else:
+            data[col] = pd.concat([frame[col] for frame in frames], ignore_index=True)
+    return pd.DataFrame(data, columns=DESIRED_COLUMNS)
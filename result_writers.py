@@ -0,0 +1,152 @@
+import csv
+import gzip
+from abc import ABC, abstractmethod
+import pandas as pd
+from config import RESULT_FORMAT, RESULT_ROW_BUFFER, data_path
+
+
+''' Writers for the result files of a run (products_data_, products_data_filtered, passed_items, failed_items). Each
+    writer is opened at the start of a run and appended to as each establishment (or patch result) comes in, so
+    nothing is held in memory until the end, and a run that is stopped partway still leaves everything written so far.
+
+    The format is picked with RESULT_FORMAT (or open_writer's fmt):
+        csv       plain csv, the default. Same file names as always (e.g. products_data_.csv)
+        csv.gz    gzip compressed csv
+        parquet   columnar Parquet file, much faster to load back into pandas for analysis
+        feather   columnar Feather (Arrow IPC) file, fastest to load back, larger than Parquet on disk
+
+    Parquet and Feather need pyarrow, which is only imported when one of them is used.'''
+
+# File extension of each format
+EXTENSIONS = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+
+# Shared parts of every writer: the columns, row buffering and the context manager
+class ResultWriter(ABC):
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.rows = []
+
+    # Appends every row of a dataframe. Each format writes it its own way
+    @abstractmethod
+    def write_frame(self, df):
+        pass
+
+    # Appends a single row given as a dict. Rows are buffered and written out RESULT_ROW_BUFFER at a time
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= RESULT_ROW_BUFFER:
+            self.flush_rows()
+
+    def flush_rows(self):
+        if self.rows:
+            rows, self.rows = self.rows, []
+            self.write_frame(pd.DataFrame(rows, columns=self.columns))
+
+    def close(self):
+        self.flush_rows()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# csv and gzip compressed csv. The header is written when the file is opened
+class CsvWriter(ResultWriter):
+    def __init__(self, path, columns, compress=False):
+        super().__init__(path, columns)
+        if compress:
+            self.file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+        self.writer.writeheader()
+        self.file.flush()
+
+    def write_frame(self, df):
+        df.to_csv(self.file, columns=self.columns, header=False, index=False)
+        self.file.flush()
+
+    # Rows go straight to the csv writer, no need to buffer them
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+# Parquet and Feather. Each write_frame is added to the file as its own row group / record batch
+class ArrowWriter(ResultWriter):
+    def __init__(self, path, columns, fmt):
+        super().__init__(path, columns)
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(f"Writing {fmt} files needs pyarrow (pip install pyarrow)") from None
+        self.pa = pyarrow
+        self.fmt = fmt
+        self.writer = None
+
+    def write_frame(self, df):
+        if not len(df):
+            return
+        ''' Categories differ from one establishment to the next, which would change the Arrow type from one batch to
+        the next. They are written as plain strings instead, and Parquet dictionary encodes them on its own. Object
+        columns are made strings as well, so a batch where a column is all empty still has the same type.'''
+        df = df[self.columns]
+        text_columns = [col for col in df.columns
+                        if isinstance(df[col].dtype, pd.CategoricalDtype) or df[col].dtype == object]
+        df = df.astype({col: 'string' for col in text_columns})
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+
+        if self.writer is None:
+            # The schema of the first batch is used for the whole file
+            self.schema = table.schema
+            if self.fmt == 'parquet':
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            # Nothing was written, but the file should still be there (and empty of rows) after the run
+            empty = self.pa.Table.from_pandas(pd.DataFrame(columns=self.columns, dtype='string'), preserve_index=False)
+            if self.fmt == 'parquet':
+                import pyarrow.parquet
+                pyarrow.parquet.write_table(empty, self.path)
+            else:
+                import pyarrow.feather
+                pyarrow.feather.write_feather(empty, self.path)
+
+
+# File name of a result file in the current format, e.g. 'passed_items.csv'. Used in the messages at the end of a run
+def result_file_name(name, fmt=None):
+    return name + EXTENSIONS.get(fmt or RESULT_FORMAT, '')
+
+
+# Opens a writer for one of the result files. name is the file name without an extension, e.g. 'passed_items'
+def open_writer(name, columns, fmt=None):
+    fmt = fmt or RESULT_FORMAT
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown result format '{fmt}', expected one of: {', '.join(EXTENSIONS)}")
+    path = data_path(result_file_name(name, fmt))
+
+    if fmt in ('csv', 'csv.gz'):
+        return CsvWriter(path, columns, compress=fmt == 'csv.gz')
+    return ArrowWriter(path, columns, fmt)
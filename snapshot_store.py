@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from condition_check import items_needing_patch
+from config import DESIRED_COLUMNS, SNAPSHOT_DB, DELTA_OVERLAP_HOURS, data_path
+from records import records_frame, concat_records
+
+
+''' Local copy of every product pulled from the API, kept in a SQLite file in the data folder between runs. Each
+    product is stored under its establishment and product id along with the values in DESIRED_COLUMNS and whether
+    it failed the condition check the last time it was seen.
+
+    On a delta run the freshly fetched items of an establishment are compared against the snapshot. Only items that
+    are new, have changed since the last run, or still needed a patch last time are passed on to the condition check
+    and the patch. Everything else is left alone. The time of the last fetch of each establishment is kept as well,
+    so the product calls can ask the API for only the items updated since then. invalidate() clears establishments
+    from the snapshot, so they are fetched in full again (cli.py --full-resync).'''
+
+
+class SnapshotStore:
+    def __init__(self, path=None):
+        self.path = path or data_path(SNAPSHOT_DB)
+        # The store is used from whichever thread is consuming the fetch, so the connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "establishment INTEGER NOT NULL, id INTEGER NOT NULL, data TEXT NOT NULL, "
+                "needs_patch INTEGER NOT NULL, PRIMARY KEY (establishment, id))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS establishments ("
+                "establishment INTEGER PRIMARY KEY, fetched_at TEXT NOT NULL)"
+            )
+
+    # Time (UTC, ISO format) to ask the API for updates from, or None when the establishment has never been fetched
+    def updated_since(self, est):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fetched_at FROM establishments WHERE establishment = ?", (est,)
+            ).fetchone()
+        if row is None:
+            return None
+        # Step back a little from the last fetch, so a difference in clocks/timezones can't make us miss an update
+        since = datetime.fromisoformat(row[0]) - timedelta(hours=DELTA_OVERLAP_HOURS)
+        return since.strftime("%Y-%m-%dT%H:%M:%S")
+
+    ''' Compares the fetched items of an establishment (a dataframe) with the snapshot, saves them, and returns a
+    dataframe of the items that need to go through the condition check. full_fetch is False when the API only sent
+    back items updated since the last run, in which case anything missing from df is unchanged rather than deleted.'''
+    def records_to_check(self, est, df, fetched_at, full_fetch=True):
+        # The condition check result is stored with each item, so unchanged items that still need a patch come back
+        needs_patch = items_needing_patch(df).tolist()
+        # Plain python values (None for anything missing), so they can be written out as json
+        records = df.astype(object).where(df.notna(), None).to_dict('records')
+
+        with self.lock:
+            existing = {
+                product_id: (data, flag) for product_id, data, flag in self.conn.execute(
+                    "SELECT id, data, needs_patch FROM products WHERE establishment = ?", (est,)
+                )
+            }
+
+            to_check = []
+            carried_over = []
+            changed_rows = []
+            seen = set()
+            changed_count = 0
+            for position, (record, flag) in enumerate(zip(records, needs_patch)):
+                data = json.dumps([record.get(col) for col in DESIRED_COLUMNS])
+                seen.add(record['id'])
+                previous = existing.get(record['id'])
+                if previous is None or previous[0] != data:
+                    # New or changed since the last run
+                    changed_rows.append((est, record['id'], data, int(flag)))
+                    to_check.append(position)
+                    changed_count += 1
+                elif previous[1]:
+                    # Unchanged, but it still needed a patch last time (the patch may have failed)
+                    to_check.append(position)
+
+            if full_fetch:
+                # Products that no longer come back from the API have been removed from the establishment
+                removed = [(est, product_id) for product_id in existing if product_id not in seen]
+                self.conn.executemany("DELETE FROM products WHERE establishment = ? AND id = ?", removed)
+            else:
+                # Items the API did not send back are unchanged. Bring back the ones that still need a patch
+                for product_id, (data, flag) in existing.items():
+                    if flag and product_id not in seen:
+                        carried_over.append(dict(zip(DESIRED_COLUMNS, json.loads(data))))
+
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)", changed_rows)
+                self.conn.execute("INSERT OR REPLACE INTO establishments VALUES (?, ?)", (est, fetched_at))
+
+        # Fetched rows keep their dtypes, rows brought back from the snapshot are converted the same way
+        df_to_check = concat_records([df.iloc[to_check], records_frame(carried_over)])
+        print(f"\nEstablishment {est}: {len(records)} items fetched, {changed_count} new or changed, "
+              f"{len(df_to_check)} to check")
+        return df_to_check
+
+    # Clears the snapshot of the given establishments (or everything), so the next delta run fetches them in full
+    def invalidate(self, id_list=None):
+        with self.lock, self.conn:
+            if id_list is None:
+                self.conn.execute("DELETE FROM products")
+                self.conn.execute("DELETE FROM establishments")
+            else:
+                self.conn.executemany("DELETE FROM products WHERE establishment = ?", [(est,) for est in id_list])
+                self.conn.executemany("DELETE FROM establishments WHERE establishment = ?", [(est,) for est in id_list])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Current time in the format stored against each establishment
+def snapshot_time():
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")
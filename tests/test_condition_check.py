@@ -0,0 +1,20 @@
+import pandas as pd
+from condition_check import check_if_item_needs_patch, items_needing_patch
+
+
+def test_vectorized_check_matches_the_row_check():
+    df = pd.DataFrame({
+        "price": [5.0, 5.0, "6.5", "abc", 7.0, 8.25, "9"],
+        "combo_upcharge": [5.0, 4.0, "6.5000", 1.0, "n/a", "8.2500", "10.0000"],
+    })
+    expected = [check_if_item_needs_patch(row) for _, row in df.iterrows()]
+    assert items_needing_patch(df).tolist() == expected
+
+
+def test_values_within_the_tolerance_are_equal():
+    df = pd.DataFrame({"price": [1.0, 1.0], "combo_upcharge": [1.00001, 1.001]})
+    assert items_needing_patch(df).tolist() == [False, True]
+
+
+def test_empty_frame_needs_no_patch():
+    assert items_needing_patch(pd.DataFrame()).tolist() == []
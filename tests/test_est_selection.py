@@ -0,0 +1,52 @@
+from est_selection import EstablishmentSelection
+
+STORES = {"Center City": 1, "Cherry Hill": 2, "King of Prussia": 3, "Media": 14}
+
+
+def names(selection, positions):
+    return [selection.names[index] for index in positions]
+
+
+def test_filter_matches_every_word_on_name_and_id():
+    selection = EstablishmentSelection(STORES)
+    assert names(selection, selection.filter("r")) == ["Center City", "Cherry Hill", "King of Prussia"]
+    assert names(selection, selection.filter("city center")) == ["Center City"]
+    assert names(selection, selection.filter("14")) == ["Media"]
+    assert names(selection, selection.filter("")) == list(STORES)
+
+
+def test_typing_on_only_searches_the_last_matches():
+    selection = EstablishmentSelection(STORES)
+    selection.filter("ch")
+    # Anything outside the last matches is never looked at again while the search only grows
+    selection.search_keys[selection.index_of_id[14]] = "chxyz 14"
+    assert names(selection, selection.filter("che")) == ["Cherry Hill"]
+    # A new search starts from the full list
+    assert names(selection, selection.filter("chx")) == ["Media"]
+
+
+def test_selection_is_kept_apart_from_the_search():
+    selection = EstablishmentSelection(STORES)
+    selection.filter("media")
+    selection.set_selected(selection.filter("media")[0], True)
+    selection.set_selected(0, True)
+    selection.filter("")
+    assert selection.selected_items() == [("Center City", 1), ("Media", 14)]
+    selection.set_selected(0, False)
+    assert selection.is_selected(3) and not selection.is_selected(0)
+
+
+def test_select_all_and_clear():
+    selection = EstablishmentSelection(STORES)
+    selection.select_all()
+    assert [est_id for _, est_id in selection.selected_items()] == [1, 2, 3, 14]
+    selection.clear()
+    assert selection.selected_items() == []
+
+
+def test_reloading_the_list_keeps_selected_establishments_that_are_still_in_it():
+    selection = EstablishmentSelection(STORES)
+    selection.set_selected(0, True)
+    selection.set_selected(1, True)
+    selection.set_establishments({"Center City": 1, "Media": 14})
+    assert selection.selected_items() == [("Center City", 1)]
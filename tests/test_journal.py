@@ -0,0 +1,67 @@
+import json
+import pandas as pd
+from journal import RunJournal
+
+
+def write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as file:
+        for line in lines:
+            file.write((line if isinstance(line, str) else json.dumps(line)) + "\n")
+
+
+def test_resume_skips_items_patched_with_a_202(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    write_lines(path, [
+        {"entry": "run_started", "establishments": [1, 2, 3]},
+        {"entry": "checked", "establishments": [1], "rows": [{"id": 10}, {"id": 11}, {"id": 12}]},
+        {"entry": "patched", "id": "10", "status_code": 202},
+        {"entry": "patched", "id": "11", "status_code": 500},
+    ])
+    journal = RunJournal(str(path))
+    state = journal.resume()
+    journal.close()
+
+    assert [row["id"] for row in state.rows_to_patch] == [11, 12]
+    assert state.checked == {1}
+    assert state.remaining == [2, 3]
+
+
+def test_resume_ignores_a_half_written_line(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    write_lines(path, [
+        {"entry": "run_started", "establishments": [1, 2]},
+        {"entry": "checked", "establishments": [1], "rows": [{"id": 10}, {"id": 10}]},
+        '{"entry": "patched", "id": "10", "sta',
+    ])
+    journal = RunJournal(str(path))
+    state = journal.resume()
+    journal.close()
+
+    # The half written patch was never confirmed, and the item listed twice is only patched once
+    assert [row["id"] for row in state.rows_to_patch] == [10]
+    assert state.remaining == [2]
+
+
+def test_resume_returns_none_for_a_finished_run(tmp_path):
+    path = tmp_path / "run_journal.jsonl"
+    write_lines(path, [
+        {"entry": "run_started", "establishments": [1]},
+        {"entry": "run_finished"},
+    ])
+    assert RunJournal(str(path)).resume() is None
+    assert RunJournal(str(tmp_path / "missing.jsonl")).resume() is None
+
+
+def test_journal_round_trip(tmp_path):
+    path = str(tmp_path / "run_journal.jsonl")
+    journal = RunJournal(path)
+    journal.start([1, 2])
+    journal.checked([1], pd.DataFrame({"id": [10, 11], "price": [1.5, None]}))
+    journal.patched("10", 202)
+    journal.close()
+
+    journal = RunJournal(path)
+    state = journal.resume()
+    journal.close()
+    assert state.rows_to_patch == [{"id": 11, "price": None}]
+    assert state.remaining == [2]
@@ -0,0 +1,58 @@
+import http_client
+from http_client import next_page, iter_pages
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.content = None
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+''' NEXT PAGE '''
+def test_next_page_follows_the_meta_next_link():
+    meta = {"next": "/resources/Product/?limit=2&offset=2&establishment=3", "total_count": 10}
+    assert next_page("/resources/Product/", {"limit": 2}, meta, 2) == \
+        ("/resources/Product/", {"limit": "2", "offset": "2", "establishment": "3"})
+
+
+def test_next_page_steps_the_offset_without_a_link():
+    params = {"limit": 2, "offset": 4}
+    assert next_page("/resources/Product/", params, {"total_count": 10}, 2) == \
+        ("/resources/Product/", {"limit": 2, "offset": 6})
+    # The params of the page just fetched are left alone
+    assert params["offset"] == 4
+
+
+def test_next_page_stops_on_the_last_page():
+    assert next_page("/resources/Product/", {"limit": 2, "offset": 8}, {"total_count": 10}, 2) is None
+    assert next_page("/resources/Product/", {"limit": 2}, {"next": None}, 2) is None
+
+
+def test_next_page_stops_on_an_empty_page():
+    # An empty page can't move the offset forward, so it must not ask for the same page again
+    assert next_page("/resources/Product/", {"limit": 2, "offset": 4}, {"total_count": 10}, 0) is None
+
+
+''' ITER PAGES '''
+def test_iter_pages_yields_every_object_of_every_page(monkeypatch):
+    pages = {
+        "0": {"meta": {"next": "/resources/Product/?limit=2&offset=2", "total_count": 5}, "objects": [1, 2]},
+        "2": {"meta": {"total_count": 5}, "objects": [3, 4]},
+        "4": {"meta": {"total_count": 5}, "objects": [5]},
+    }
+    requested = []
+
+    def fake_get(path, params=None):
+        requested.append(str(params.get("offset", 0)))
+        return FakeResponse(pages[str(params.get("offset", 0))])
+
+    monkeypatch.setattr(http_client, "api_get", fake_get)
+    monkeypatch.setattr(http_client, "orjson", None)
+    assert list(iter_pages("/resources/Product/", {"limit": 2})) == [1, 2, 3, 4, 5]
+    assert requested == ["0", "2", "4"]
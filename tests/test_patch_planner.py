@@ -0,0 +1,46 @@
+import pandas as pd
+from patch_planner import PatchPlanner, build_payloads, full_payload, FULL_PAYLOAD_FIELDS
+
+
+def items(*rows):
+    base = {"name": "Tray", "establishment": "/enterprise/Establishment/1/", "category": "/products/ProductCategory/5/",
+            "updated_by": "/enterprise/User/1/", "created_by": "/enterprise/User/2/", "attribute_type": 2,
+            "tax_class": 0, "variable_pricing_by": 0, "sorting": 1}
+    return pd.DataFrame([dict(base, id=product_id, price=price, combo_upcharge=upcharge)
+                         for product_id, price, upcharge in rows])
+
+
+def test_plan_drops_repeated_ids_within_a_batch():
+    plan = PatchPlanner(minimal=True).plan(items((1, 5.0, 4.0), (1, 5.0, 4.0), (2, 6.0, 1.0)))
+    assert [row["id"] for row in plan.rows] == [1, 2]
+
+
+def test_plan_drops_ids_planned_in_an_earlier_batch():
+    planner = PatchPlanner(minimal=True)
+    planner.plan(items((1, 5.0, 4.0)))
+    plan = planner.plan(items((1, 5.0, 4.0), (2, 6.0, 1.0)))
+    assert [row["id"] for row in plan.rows] == [2]
+    assert planner.duplicates == 1
+    assert planner.planned == 2
+
+
+def test_plan_drops_no_op_changes():
+    planner = PatchPlanner(minimal=True)
+    plan = planner.plan(items((1, 5.0, 5.00001), (2, 6.0, 1.0), (3, 7.0, None)))
+    assert [row["id"] for row in plan.rows] == [2]
+    assert planner.no_ops == 2
+
+
+def test_minimal_payload_only_sends_the_upcharge():
+    plan = PatchPlanner(minimal=True).plan(items((1, 12.99, 1.0)))
+    assert plan.rows[0]["payload"] == {"combo_upcharge": "12.99"}
+
+
+def test_full_payload_sends_null_for_missing_values():
+    df = items((1, 5.0, 4.0))
+    df["tax_class"] = pd.array([None], dtype="Int32")
+    payload = build_payloads(df, minimal=False)[0]
+    assert list(payload) == FULL_PAYLOAD_FIELDS
+    assert payload["tax_class"] is None
+    assert payload["price"] == 5.0 and payload["combo_upcharge"] == "5.0"
+    assert full_payload(df.to_dict("records")[0]) == payload
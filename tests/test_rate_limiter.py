@@ -0,0 +1,75 @@
+import time
+from rate_limiter import AdaptiveLimiter, parse_retry_after
+
+
+def limiter(**kwargs):
+    settings = dict(rate=100, max_rate=200, burst=100, min_concurrency=2, max_concurrency=8, initial_concurrency=4,
+                    latency_spike_factor=3)
+    settings.update(kwargs)
+    return AdaptiveLimiter(**settings)
+
+
+# Sends one request through the limiter and hands back the given outcome
+def send(limiter, latency=0.01, status_code=200, retry_after=None, endpoint="GET /resources/Product/"):
+    limiter.acquire()
+    limiter.release(latency, status_code, retry_after, endpoint)
+
+
+def test_a_full_window_of_healthy_requests_adds_one_slot():
+    adaptive = limiter()
+    for _ in range(4):
+        send(adaptive)
+    assert adaptive.limit == 5
+    assert adaptive.rate == 104
+
+
+def test_the_limit_never_goes_past_the_maximum():
+    adaptive = limiter(initial_concurrency=8)
+    for _ in range(20):
+        send(adaptive)
+    assert adaptive.limit == 8
+
+
+def test_a_429_halves_the_limit_and_rate_and_pauses():
+    adaptive = limiter()
+    send(adaptive, status_code=429, retry_after="2")
+    assert adaptive.limit == 2
+    assert adaptive.rate == 50
+    assert adaptive.throttled == 1
+    assert adaptive.paused_until > time.monotonic() + 1
+
+
+def test_a_server_error_halves_the_limit_but_not_the_rate():
+    adaptive = limiter(initial_concurrency=8)
+    send(adaptive, status_code=503)
+    assert adaptive.limit == 4
+    assert adaptive.rate == 100
+    assert adaptive.errors == 1
+
+
+def test_a_burst_of_errors_only_counts_once():
+    adaptive = limiter(initial_concurrency=8)
+    send(adaptive, status_code=500)
+    send(adaptive, status_code=500)
+    assert adaptive.limit == 4
+
+
+def test_latency_spikes_are_judged_per_endpoint():
+    adaptive = limiter(initial_concurrency=8)
+    for _ in range(5):
+        send(adaptive, latency=0.2, endpoint="PATCH /resources/Product/{id}/")
+    limit = adaptive.limit
+    # A product page is slower than a PATCH, but normal for its own endpoint
+    send(adaptive, latency=0.8, endpoint="GET /resources/Product/")
+    send(adaptive, latency=0.8, endpoint="GET /resources/Product/")
+    assert adaptive.limit >= limit
+    # The same latency on the PATCH endpoint is a spike
+    send(adaptive, latency=0.8, endpoint="PATCH /resources/Product/{id}/")
+    assert adaptive.limit < limit
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) == 1.0
+    assert parse_retry_after("not a date") == 1.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
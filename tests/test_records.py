@@ -0,0 +1,47 @@
+from config import DESIRED_COLUMNS
+from records import ProductRecords, records_frame, concat_records, NUMERIC_DTYPES, CATEGORICAL_COLUMNS
+
+
+def item(product_id, establishment=1, **values):
+    return dict({"id": product_id, "name": f"Tray {product_id}", "price": "5.00", "combo_upcharge": "5.0000",
+                 "establishment": f"/enterprise/Establishment/{establishment}/", "attribute_type": 2},
+                **values)
+
+
+def test_to_frame_uses_compact_dtypes():
+    df = records_frame([item(1), item(2)])
+    assert list(df.columns) == DESIRED_COLUMNS
+    for col, dtype in NUMERIC_DTYPES.items():
+        assert str(df[col].dtype) == dtype
+    for col in CATEGORICAL_COLUMNS:
+        assert str(df[col].dtype) == "category"
+    assert df["price"].tolist() == [5.0, 5.0]
+
+
+def test_missing_and_unreadable_values_become_na():
+    df = records_frame([item(1, price="n/a"), {"id": 2}])
+    assert df["price"].isna().tolist() == [True, True]
+    assert df["attribute_type"].isna().tolist() == [False, True]
+    assert df["name"].isna().tolist() == [False, True]
+
+
+def test_extend_appends_the_columns_of_another_batch():
+    records = ProductRecords().append_items([item(1)])
+    records.extend(ProductRecords().append_items([item(2)]))
+    assert len(records) == 2
+    assert records.to_frame()["id"].tolist() == [1, 2]
+
+
+def test_concat_records_keeps_categoricals_with_different_categories():
+    df = concat_records([records_frame([item(1, establishment=1)]), records_frame([]),
+                         records_frame([item(2, establishment=2)])])
+    assert df["id"].tolist() == [1, 2]
+    assert str(df["establishment"].dtype) == "category"
+    assert df["establishment"].tolist() == ["/enterprise/Establishment/1/", "/enterprise/Establishment/2/"]
+    assert str(df["id"].dtype) == "Int64"
+
+
+def test_concat_records_of_nothing_is_an_empty_frame():
+    df = concat_records([])
+    assert df.empty
+    assert list(df.columns) == DESIRED_COLUMNS
@@ -0,0 +1,67 @@
+import pytest
+from records import records_frame
+from snapshot_store import SnapshotStore
+
+
+def item(product_id, price=5.0, upcharge=5.0, name="Tray"):
+    return {"id": product_id, "name": name, "price": price, "combo_upcharge": upcharge,
+            "establishment": "/enterprise/Establishment/1/", "category": "/products/ProductCategory/5/"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshot.sqlite3"))
+    yield store
+    store.close()
+
+
+def ids(df):
+    return sorted(df["id"].tolist())
+
+
+def test_first_run_checks_every_item(store):
+    df = records_frame([item(1), item(2, upcharge=4.0)])
+    assert ids(store.records_to_check(1, df, "2026-01-01T00:00:00")) == [1, 2]
+
+
+def test_unchanged_items_are_skipped_unless_they_still_need_a_patch(store):
+    store.records_to_check(1, records_frame([item(1), item(2, upcharge=4.0)]), "2026-01-01T00:00:00")
+    # 1 is unchanged and matched, 2 is unchanged but was never fixed
+    df = records_frame([item(1), item(2, upcharge=4.0)])
+    assert ids(store.records_to_check(1, df, "2026-01-02T00:00:00")) == [2]
+
+
+def test_changed_and_new_items_are_checked(store):
+    store.records_to_check(1, records_frame([item(1), item(2)]), "2026-01-01T00:00:00")
+    df = records_frame([item(1, price=6.0), item(2), item(3)])
+    assert ids(store.records_to_check(1, df, "2026-01-02T00:00:00")) == [1, 3]
+
+
+def test_full_fetch_forgets_removed_items(store):
+    store.records_to_check(1, records_frame([item(1), item(2)]), "2026-01-01T00:00:00")
+    store.records_to_check(1, records_frame([item(1)]), "2026-01-02T00:00:00")
+    # 2 was removed from the establishment, so it comes back as new
+    df = records_frame([item(1), item(2)])
+    assert ids(store.records_to_check(1, df, "2026-01-03T00:00:00")) == [2]
+
+
+def test_partial_fetch_carries_over_items_that_still_need_a_patch(store):
+    store.records_to_check(1, records_frame([item(1), item(2, upcharge=4.0)]), "2026-01-01T00:00:00")
+    # Only 3 was updated since the last fetch. 2 wasn't sent back but still needs its patch
+    df = store.records_to_check(1, records_frame([item(3)]), "2026-01-02T00:00:00", full_fetch=False)
+    assert ids(df) == [2, 3]
+    assert df.loc[df["id"] == 2, "combo_upcharge"].item() == 4.0
+
+
+def test_updated_since_steps_back_from_the_last_fetch(store):
+    assert store.updated_since(1) is None
+    store.records_to_check(1, records_frame([item(1)]), "2026-01-02T00:00:00")
+    assert store.updated_since(1) < "2026-01-02T00:00:00"
+
+
+def test_invalidate_clears_only_the_given_establishments(store):
+    store.records_to_check(1, records_frame([item(1)]), "2026-01-01T00:00:00")
+    store.records_to_check(2, records_frame([item(1)]), "2026-01-01T00:00:00")
+    store.invalidate([1])
+    assert store.updated_since(1) is None
+    assert store.updated_since(2) is not None
@@ -0,0 +1,177 @@
+import functools
+import json
+import math
+import re
+import threading
+import time
+from contextlib import nullcontext
+import config
+from config import data_path
+
+
+''' Timing spans for finding out where the time of a run goes. Code that is worth timing is wrapped in a span:
+
+        with tracer.span("get_category_data", est=est):
+            ...
+
+    and every span that finishes is kept with its start, duration, thread and arguments. At the end of a run the
+    spans can be written out as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev to see every
+    worker thread on a timeline), and summary() prints latency percentiles per endpoint/stage and for the slowest
+    establishments.
+
+    Tracing is off unless TRACING is turned on in config (or cli.py --trace). While it's off, span() hands back the
+    same do-nothing context every time, so the spans left in the code cost next to nothing.
+
+    Every request is a span of its own (see http_client.py), so a full fleet with tracing on keeps a few hundred
+    thousand spans in memory until the end of the run. Turn it on to look into a slow run, not for every run.'''
+
+# Handed out by span() while tracing is off
+_NULL_SPAN = nullcontext()
+
+# Product ids and other numbers in a url path, so every PATCH /resources/Product/<id>/ is counted as one endpoint
+_PATH_NUMBER = re.compile(r"/\d+(?=/|$)")
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+
+
+class Tracer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # Spans are recorded from every worker thread
+        self.lock = threading.Lock()
+        self.reset()
+
+    # Drops every recorded span, e.g. at the start of a run
+    def reset(self):
+        with self.lock:
+            # (name, cat, start ns, end ns, thread id, args)
+            self.spans = []
+            self.thread_names = {}
+            self.started = time.perf_counter_ns()
+
+    # Times the code inside the with block. cat groups spans in the trace viewer ('http', 'fetch', 'check', 'patch').
+    # args are kept with the span (est=..., rows=...)
+    def span(self, name, cat="app", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    # Records a span that was timed elsewhere, e.g. one that starts and ends in different threads
+    def record(self, name, cat, start, end, args=None):
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        with self.lock:
+            self.spans.append((name, cat, start, end, thread.ident, args or {}))
+            self.thread_names[thread.ident] = thread.name
+
+    # Span name of a request, e.g. 'PATCH /resources/Product/{id}/'
+    @staticmethod
+    def endpoint(method, path):
+        return f"{method} {_PATH_NUMBER.sub('/{id}', path)}"
+
+    # Durations (seconds) of the recorded spans, grouped by a key function of (name, cat, args)
+    def durations(self, key):
+        with self.lock:
+            spans = list(self.spans)
+        groups = {}
+        for name, cat, start, end, _, args in spans:
+            group = key(name, cat, args)
+            if group is not None:
+                groups.setdefault(group, []).append((end - start) / 1e9)
+        return groups
+
+    # Writes every span as a Chrome trace event json file
+    def export_chrome_trace(self, path):
+        with self.lock:
+            spans = list(self.spans)
+            thread_names = dict(self.thread_names)
+
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+                  for tid, name in thread_names.items()]
+        for name, cat, start, end, tid, args in spans:
+            events.append({
+                "name": name, "cat": cat, "ph": "X", "pid": 1, "tid": tid,
+                # Microseconds from the start of the run
+                "ts": (start - self.started) / 1000, "dur": (end - start) / 1000,
+                "args": {key: str(value) for key, value in args.items()},
+            })
+
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    # Table of latency percentiles per endpoint/stage, then the slowest establishments
+    def summary(self, top=10):
+        lines = [f"{'span':<44}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        by_name = self.durations(lambda name, cat, args: name)
+        # Most total time first, that's where the run went
+        for name, values in sorted(by_name.items(), key=lambda item: -sum(item[1])):
+            lines.append(_summary_row(name, values))
+
+        # Establishments by their wall time from being let into the pool to their last product call coming back
+        by_est = self.durations(lambda name, cat, args: args.get("est") if name == "establishment" else None)
+        calls = self.durations(lambda name, cat, args: args.get("est") if name == "get_product_records" else None)
+        if by_est:
+            lines.append("")
+            lines.append(f"{'slowest establishments':<44}{'calls':>8}{'wall s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+                         f"{'p99 ms':>10}{'max ms':>10}")
+            for est, wall in sorted(by_est.items(), key=lambda item: -max(item[1]))[:top]:
+                # Latency of its product calls, with the wall time in place of the total
+                lines.append(_summary_row(f"est {est}", calls.get(est, []), total=max(wall)))
+        return "\n".join(lines)
+
+
+# One row of the summary table. total replaces the sum of the values when given
+def _summary_row(label, values, total=None):
+    values = sorted(values)
+    total = sum(values) if total is None else total
+    if not values:
+        return f"{label[:43]:<44}{0:>8}{total:>10.2f}"
+    return (f"{label[:43]:<44}{len(values):>8}{total:>10.2f}{_percentile(values, 50) * 1000:>10.1f}"
+            f"{_percentile(values, 95) * 1000:>10.1f}{_percentile(values, 99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+
+
+# Nearest rank percentile of a sorted list
+def _percentile(values, percent):
+    index = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+# Shared tracer that every module records to. Turned on by trace_run when TRACING is set
+tracer = Tracer()
+
+
+# Decorator for the function that runs a whole patch (main.main). With TRACING on, the run is traced from start to
+# finish, then the trace is written to TRACE_FILE in the data folder and the summary table is printed
+def trace_run(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Read at call time, so cli.py --trace can turn it on
+        if not config.TRACING:
+            return func(*args, **kwargs)
+        tracer.reset()
+        tracer.enabled = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.enabled = False
+            path = data_path(config.TRACE_FILE)
+            tracer.export_chrome_trace(path)
+            print(f"\n{tracer.summary()}")
+            print(f"\nTrace written to {path}, open it in chrome://tracing or https://ui.perfetto.dev")
+    return wrapper